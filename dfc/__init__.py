@@ -1,3 +1,5 @@
 from .scanner import *
 from .parser import *
+from .resolver import *
+from .astcache import parse_file
 from .generator import *
@@ -0,0 +1,358 @@
+import codecs, hashlib, json, mmap, os, pickle, threading
+from dataclasses import dataclass
+from json.decoder import WHITESPACE
+from types import MappingProxyType
+
+# bump this whenever the layout of the cached registry changes
+CACHE_VERSION = 3
+CACHE_DIR_NAME = "__dfccache__"
+
+# top level sections of the dump the compiler actually reads
+ACTION_DUMP_SECTIONS = ("codeblocks", "actions")
+
+# keys kept on every object inside those sections, the rest (descriptions,
+# icon materials, examples, ...) is only used by the DiamondFire client
+ACTION_DUMP_KEYS = frozenset((
+    "name", "identifier", "codeblockName", "aliases",
+    "tags", "options", "defaultOption", "slot",
+    "icon", "arguments", "type", "plural", "optional", "text",
+))
+
+
+def read_action_dump(source, sections: tuple = ACTION_DUMP_SECTIONS) -> dict:
+    """Reads only `sections` of an action dump.
+
+    `source` is the dump itself, as JSON text or a bytes-like buffer (bytes,
+    mmap, ...), or an os.PathLike path to it, a plain str is always text.
+    The dump is decoded a chunk at a time, so only a small window of it is
+    ever held as text, and reading stops as soon as every wanted section has
+    been seen, the sections after them are never touched. Other top level
+    sections are skipped without being kept in memory and objects inside the
+    read sections are trimmed to ACTION_DUMP_KEYS.
+    """
+    if isinstance(source, os.PathLike):
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return read_action_dump(buf, sections)
+
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+
+    reader = _DumpReader(source)
+    decoder = json.JSONDecoder(object_pairs_hook=_trim_object)
+    # objects of skipped values are replaced by their key count as soon as
+    # they are parsed, a builtin hook keeps this entirely inside the C scanner
+    skipper = json.JSONDecoder(object_pairs_hook=len)
+
+    df_data = {}
+    reader.expect("{")
+
+    first = True
+    while reader.peek() != "}" and not all(section in df_data for section in sections):
+        if not first:
+            reader.expect(",")
+
+        first = False
+
+        key = reader.decode(_KEY_DECODER)
+        if not isinstance(key, str):
+            raise ValueError(f"Malformed action dump, expected a key at offset {reader.offset()}")
+
+        reader.expect(":")
+        if key in sections:
+            df_data[key] = reader.read_value(decoder)
+        else:
+            reader.read_value(skipper)
+
+    for section in sections:
+        if section not in df_data:
+            raise ValueError(f"Action dump is missing the '{section}' section")
+
+    return df_data
+
+
+# plain decoder for top level keys
+_KEY_DECODER = json.JSONDecoder()
+
+# characters a number can continue with
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+# bytes decoded per chunk, grown for single values that don't fit in one
+_CHUNK_SIZE = 1 << 18
+
+
+class _DumpReader:
+    """Walks a json buffer one value at a time, decoding it chunk by chunk.
+
+    Only the current chunk is held as text. It is refilled from the buffer
+    whenever a value runs past its end, containers at the top of a section
+    are read one entry at a time so their entries are what has to fit.
+    """
+    __slots__ = ("buf", "text", "idx", "start", "final", "size")
+
+    def __init__(self, buf) -> None:
+        self.buf = buf
+        self.text = ""
+        self.idx = 0
+        self.start = 0 # byte offset of text[0] in buf
+        self.final = False # text reaches the end of buf
+        self.size = _CHUNK_SIZE
+        self._refill()
+
+    def offset(self, idx: int = None) -> int:
+        return self.start + len(self.text[:self.idx if idx is None else idx].encode("utf-8"))
+
+    def _refill(self) -> None:
+        start = self.offset()
+        end = start + self.size
+        self.final = end >= len(self.buf)
+        # a character cut in half at the end of the chunk is held back by the
+        # incremental decoder and read again with the next chunk
+        self.text = codecs.getincrementaldecoder("utf-8")().decode(self.buf[start:end], self.final)
+        self.start = start
+        self.idx = 0
+
+    def peek(self) -> str:
+        while True:
+            self.idx = WHITESPACE.match(self.text, self.idx).end()
+            if self.idx < len(self.text) or self.final:
+                return self.text[self.idx:self.idx + 1]
+
+            self._refill()
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Malformed action dump, expected '{char}' at offset {self.offset()}")
+
+        self.idx += 1
+
+    def decode(self, decoder: json.JSONDecoder):
+        self.peek()
+        while True:
+            try:
+                (value, end) = decoder.raw_decode(self.text, self.idx)
+                # a number cut off by the end of the chunk still parses, but only
+                # a complete one can be followed by something else than a digit
+                if self.final or (end < len(self.text) and self.text[end] not in _NUMBER_CHARS):
+                    self.idx = end
+                    return value
+
+            except json.JSONDecodeError as e:
+                if self.final:
+                    raise ValueError(f"Malformed action dump, {e.msg} at offset {self.offset(e.pos)}") from None
+
+            # the value didn't fit in what is left of the chunk, start a new one
+            # on it, and make chunks bigger if it didn't fit in a whole one
+            if self.idx == 0:
+                self.size *= 2
+
+            self._refill()
+
+    def read_value(self, decoder: json.JSONDecoder):
+        """Decodes the next value, arrays and objects one entry at a time."""
+        char = self.peek()
+        if char == "[":
+            self.idx += 1
+            items = []
+            while self.peek() != "]":
+                if items:
+                    self.expect(",")
+
+                items.append(self.decode(decoder))
+
+            self.idx += 1
+            return items
+
+        if char == "{":
+            self.idx += 1
+            pairs = []
+            while self.peek() != "}":
+                if pairs:
+                    self.expect(",")
+
+                key = self.decode(_KEY_DECODER)
+                if not isinstance(key, str):
+                    raise ValueError(f"Malformed action dump, expected a key at offset {self.offset()}")
+
+                self.expect(":")
+                pairs.append((key, self.decode(decoder)))
+
+            self.idx += 1
+            return decoder.object_pairs_hook(pairs) if decoder.object_pairs_hook else dict(pairs)
+
+        return self.decode(decoder)
+
+
+def _trim_object(pairs: list) -> dict:
+    return {key: value for (key, value) in pairs if key in ACTION_DUMP_KEYS}
+
+
+@dataclass(frozen=True, slots=True)
+class ArgumentRecord:
+    type: str
+    plural: bool = False
+    optional: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class TagRecord:
+    name: str
+    options: tuple[str, ...]
+    default_option: str
+    slot: int
+
+
+@dataclass(frozen=True, slots=True)
+class ActionRecord:
+    name: str
+    codeblock: str # codeblock identifier, e.g. 'player_action'
+    tags: tuple[TagRecord, ...]
+    arguments: tuple[ArgumentRecord, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class CodeblockRecord:
+    name: str # e.g. 'PLAYER ACTION'
+    identifier: str
+
+
+class ActionRegistry:
+    """Read-only view of an action dump.
+
+    Nothing can be changed after construction, so one registry can be shared
+    by any number of Generators and Codeblocks, across threads.
+    """
+    __slots__ = ("digest", "codeblocks", "actions", "_by_id", "_by_name", "_actions", "__weakref__")
+
+    def __init__(self, codeblocks: tuple[CodeblockRecord, ...], actions: tuple[ActionRecord, ...], digest: str = None) -> None:
+        by_id = {}
+        by_name = {}
+        for cb in codeblocks:
+            # first definition wins, same as DiamondFire
+            by_id.setdefault(cb.identifier, cb)
+            by_name.setdefault(cb.name, cb)
+
+        object.__setattr__(self, "digest", digest)
+        object.__setattr__(self, "codeblocks", tuple(codeblocks))
+        object.__setattr__(self, "actions", tuple(actions))
+        object.__setattr__(self, "_by_id", MappingProxyType(by_id))
+        object.__setattr__(self, "_by_name", MappingProxyType(by_name))
+        object.__setattr__(self, "_actions", MappingProxyType({(action.codeblock, action.name): action for action in actions}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{type(self).__name__}' is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'{type(self).__name__}' is read-only")
+
+    def __reduce__(self):
+        return (ActionRegistry, (self.codeblocks, self.actions, self.digest))
+
+    def codeblock(self, identifier: str) -> CodeblockRecord:
+        return self._by_id.get(identifier)
+
+    def codeblock_by_name(self, name: str) -> CodeblockRecord:
+        return self._by_name.get(name)
+
+    def action(self, codeblock: str, action: str) -> ActionRecord:
+        return self._actions.get((codeblock, action))
+
+
+def build_action_registry(df_data: dict, digest: str = None) -> ActionRegistry:
+    codeblocks = tuple(CodeblockRecord(name=cb["name"], identifier=cb["identifier"]) for cb in df_data["codeblocks"])
+    ids = {}
+    for cb in codeblocks:
+        ids.setdefault(cb.name, cb.identifier)
+
+    actions = []
+    for action in df_data["actions"]:
+        if action["codeblockName"] not in ids: continue
+
+        tags = tuple(
+            TagRecord(
+                name=tag["name"],
+                options=tuple(option["name"] for option in tag["options"]),
+                default_option=tag["defaultOption"],
+                slot=tag["slot"]
+            )
+            for tag in action["tags"]
+        )
+
+        # entries without a type are only text separators in the DF menu
+        arguments = tuple(
+            ArgumentRecord(type=arg["type"], plural=arg["plural"], optional=arg["optional"])
+            for arg in action["icon"].get("arguments", ())
+            if "type" in arg
+        )
+
+        actions.append(ActionRecord(name=action["name"], codeblock=ids[action["codeblockName"]], tags=tags, arguments=arguments))
+
+    return ActionRegistry(codeblocks, tuple(actions), digest)
+
+
+# registries already loaded by this process, keyed by dump hash
+_registries: dict[str, ActionRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def load_action_registry(path: str, cache_dir: str = None) -> ActionRegistry:
+    """Loads the action dump at `path` into an ActionRegistry.
+
+    The registry is pickled into `cache_dir` (defaults to a __dfccache__
+    folder next to the dump) under the dump's content hash, so later runs skip
+    json parsing entirely. A changed dump hashes differently and is re-read.
+    Within one process every load of the same dump returns the same registry.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        digest = hashlib.sha256(buf).hexdigest()
+
+        with _registries_lock:
+            if digest in _registries:
+                return _registries[digest]
+
+            if cache_dir is None:
+                cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+
+            cache_path = os.path.join(cache_dir, os.path.basename(path) + ".pickle")
+
+            registry = _read_cache(cache_path, digest)
+            if registry is None:
+                registry = build_action_registry(read_action_dump(buf), digest)
+                _write_cache(cache_path, digest, registry)
+
+            _registries[digest] = registry
+            return registry
+
+
+def _read_cache(cache_path: str, digest: str):
+    try:
+        with open(cache_path, "rb") as f:
+            (version, cached_digest) = pickle.load(f)
+            if version != CACHE_VERSION or cached_digest != digest:
+                return None
+
+            return pickle.load(f)
+
+    # missing, unreadable or corrupt cache, just rebuild it
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+
+
+def _write_cache(cache_path: str, digest: str, registry: ActionRegistry):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump((CACHE_VERSION, digest), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(registry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # atomic, so concurrent compiles never see a half written cache
+        os.replace(tmp_path, cache_path)
+
+    # caching is best effort, a read-only location shouldn't break compiling
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
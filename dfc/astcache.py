@@ -0,0 +1,137 @@
+import hashlib, os, pickle
+from . import nodes, parser, scanner
+from .parser import Parser
+from .scanner import Scanner, SourceFile
+
+# bump this whenever the layout of a cached tree changes
+AST_CACHE_VERSION = 1
+AST_CACHE_SUFFIX = ".dfcc"
+# next to the source, like the generated functions' __dfccache__/functions
+AST_CACHE_DIR = os.path.join("__dfccache__", "trees")
+# The only globals a cached tree may reference: the node classes, types and
+# tokens. Names are matched exactly, pickle would otherwise follow a dotted
+# name through the module's imports (dfc.scanner -> re -> ... -> eval).
+_TREE_GLOBALS = frozenset(
+    [(nodes.__name__, name) for (name, obj) in vars(nodes).items() if isinstance(obj, type) and obj.__module__ == nodes.__name__]
+    + [(nodes.__name__, "Type.get")]
+    + [(scanner.__name__, name) for name in ("Token", "TokenType", "TokenLocation")]
+)
+
+
+def parse_file(path: str, cache: bool = True) -> nodes.TopDefinitions:
+    """Scans and parses the source at `path`.
+
+    The tree is cached in __dfccache__/trees next to the source (test.dfc ->
+    __dfccache__/trees/test.dfcc), keyed by the source's hash and the
+    compiler version, so an unchanged source is loaded without being
+    scanned or parsed again.
+    Constants are already substituted in the parsed tree, so the cached one
+    doesn't need the parser at all.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    # same newline handling as reading the source in text mode
+    code = raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    digest = hashlib.sha256(raw).hexdigest()
+    (source_dir, name) = os.path.split(os.path.abspath(path))
+    cache_path = os.path.join(source_dir, AST_CACHE_DIR, name + "c" if name.endswith(".dfc") else name + AST_CACHE_SUFFIX)
+
+    s = Scanner()
+    s.input(code, path)
+
+    if cache:
+        tree = _read_tree(cache_path, digest, s.source)
+        if tree is not None:
+            return tree
+
+    tree = Parser().parse(s.token_buffer(), path)
+
+    if cache:
+        _write_tree(cache_path, digest, s.source, tree)
+
+    return tree
+
+
+def compiler_version() -> str:
+    """Hash of everything that decides what a parsed tree looks like."""
+    global _compiler_version
+
+    if _compiler_version is None:
+        h = hashlib.sha256(str(AST_CACHE_VERSION).encode())
+        for module in (scanner, parser, nodes):
+            with open(module.__file__, "rb") as f:
+                h.update(f.read())
+
+        _compiler_version = h.hexdigest()
+
+    return _compiler_version
+
+_compiler_version: str = None
+
+
+# Locations in the tree point at the SourceFile, which holds the whole source
+# text. It isn't written to the cache, the source is read anyway to hash it.
+class _TreePickler(pickle.Pickler):
+    def __init__(self, file, source: SourceFile) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.source = source
+
+    def persistent_id(self, obj):
+        return "source" if obj is self.source else None
+
+class _TreeUnpickler(pickle.Unpickler):
+    def __init__(self, file, source: SourceFile) -> None:
+        super().__init__(file)
+        self.source = source
+
+    def persistent_load(self, pid):
+        if pid != "source":
+            raise pickle.UnpicklingError(f"Unknown persistent id '{pid}'")
+
+        return self.source
+
+    def find_class(self, module, name):
+        if (module, name) not in _TREE_GLOBALS:
+            raise pickle.UnpicklingError(f"'{module}.{name}' can't be part of a cached tree")
+
+        return super().find_class(module, name)
+
+
+def _read_tree(cache_path: str, digest: str, source: SourceFile) -> nodes.TopDefinitions:
+    try:
+        with open(cache_path, "rb") as f:
+            (version, cached_digest) = _TreeUnpickler(f, source).load()
+            if version != compiler_version() or cached_digest != digest:
+                return None
+
+            return _TreeUnpickler(f, source).load()
+
+    # missing, unreadable or corrupt cache, just parse the source again
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, RecursionError, pickle.UnpicklingError):
+        return None
+
+
+def _write_tree(cache_path: str, digest: str, source: SourceFile, tree: nodes.TopDefinitions):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump((compiler_version(), digest), f, protocol=pickle.HIGHEST_PROTOCOL)
+            _TreePickler(f, source).dump(tree)
+
+        # atomic, so concurrent compiles never see a half written cache
+        os.replace(tmp_path, cache_path)
+
+    # Caching is best effort, a read-only location or a tree nested too deep
+    # for pickle shouldn't break compiling. The tree is still returned.
+    except (OSError, RecursionError, pickle.PicklingError):
+        pass
+
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,117 @@
+import hashlib, os, pickle
+from dataclasses import fields, is_dataclass
+from . import nodes
+from .scanner import Token
+
+# bump this whenever the layout of a cached function changes
+CODEGEN_CACHE_VERSION = 2
+
+# modules whose code decides what a function generates into
+_GENERATOR_MODULES = ("nodes.py", "resolver.py", "generator.py", "diamondfire.py", "codecache.py", "ir.py", "passes.py")
+
+
+def function_key(node: nodes.FuncDefinition, registry_digest: str, optimization_level: int = 0) -> str:
+    """Cache key of the code generated for a resolved function.
+
+    Covers the function's tree (without locations, moving a function around
+    doesn't change its code), the signature of every function it calls, the
+    type and scope of every variable it references (globals included) and
+    the action dump, generator and optimization level it's generated with.
+    """
+    parts = [generator_version(), registry_digest or "", str(optimization_level)]
+    _fingerprint(node, parts)
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+# works for FuncDefinitions and FunctionSymbols
+def function_signature(node) -> str:
+    args = ", ".join(f"{'out ' if arg[4] else ''}{arg[0]}: {arg[1]}{'...' if arg[3] else ''}{'?' if arg[2] else ''} {arg[5]!r}" for arg in node.args)
+    return f"{node.name}({args})"
+
+
+def generator_version() -> str:
+    global _generator_version
+
+    if _generator_version is None:
+        h = hashlib.sha256(str(CODEGEN_CACHE_VERSION).encode())
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in _GENERATOR_MODULES:
+            with open(os.path.join(package_dir, name), "rb") as f:
+                h.update(f.read())
+
+        _generator_version = h.hexdigest()
+
+    return _generator_version
+
+_generator_version: str = None
+
+
+def _fingerprint(node, parts: list):
+    # Expressions can nest deeper than Python's recursion limit, so the tree
+    # is walked with a stack of (is a node, node or finished part) pairs.
+    stack = [(True, node)]
+
+    while stack:
+        (is_node, node) = stack.pop()
+
+        if not is_node:
+            parts.append(node)
+
+        elif isinstance(node, nodes.Type):
+            parts.append(str(node))
+
+        elif isinstance(node, Token):
+            parts.append(f"{node.type.name} {node.value}")
+
+        elif isinstance(node, (list, tuple)):
+            parts.append("[")
+            stack.append((False, "]"))
+            stack.extend((True, item) for item in reversed(node))
+
+        elif is_dataclass(node):
+            parts.append(type(node).__name__)
+            stack.append((False, ")"))
+
+            # what the names in the function were resolved to
+            if isinstance(node, (nodes.Variable, nodes.AssignVar)):
+                stack.append((False, f"{node.symbol.scope} {node.symbol.type}"))
+
+            elif isinstance(node, nodes.CallFunction):
+                stack.append((False, function_signature(node.symbol)))
+
+            stack.extend((True, getattr(node, f.name)) for f in reversed(fields(node)) if f.name not in ("location", "symbol"))
+
+        else:
+            parts.append(repr(node))
+
+
+def load_function(cache_dir: str, key: str) -> tuple[list, str]:
+    """(generated blocks, template data) cached under `key`, or None."""
+    try:
+        with open(os.path.join(cache_dir, key + ".pickle"), "rb") as f:
+            return pickle.load(f)
+
+    # missing, unreadable or corrupt cache, the function is just generated again
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return None
+
+
+def store_function(cache_dir: str, key: str, blocks: list, template: str):
+    cache_path = os.path.join(cache_dir, key + ".pickle")
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump((blocks, template), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # atomic, so concurrent compiles never see a half written cache
+        os.replace(tmp_path, cache_path)
+
+    # caching is best effort, a read-only location shouldn't break compiling
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
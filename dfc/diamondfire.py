@@ -1,150 +1,224 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import ClassVar, List
 from abc import ABC, abstractmethod
-import gzip, base64, json
+import gzip, base64, io, json, weakref
+from json.encoder import encode_basestring_ascii as _json_str
+from concurrent.futures import ThreadPoolExecutor
+from .actiondump import ActionRecord, ActionRegistry
 
-ACTION_DATA: dict = None
+# encode() methods write the exact JSON json.dumps writes for generate(), just
+# without building the dicts first
+def _json(value) -> str:
+    return _json_str(value) if type(value) is str else json.dumps(value)
 
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class Item(ABC):
-    slot: int
-    id: str
+    """A value in a codeblock's chest.
 
-    def __init__(self, slot: int = 0) -> None:
-        self.slot = slot
+    Items are immutable, the slot an item goes in is its position in the
+    codeblock's args. Items made through `get` are interned: every use of the
+    same value is the same item and its JSON is only written once. Interned
+    items are only kept while something still uses them.
+    """
+    id: ClassVar[str]
+    _json: str = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def get(cls, *args) -> "Item":
+        # 1 and 1.0 are equal but don't serialize the same, so types are part of the key
+        key = (cls, args, tuple(type(arg) for arg in args))
+        item = _items.get(key)
+
+        if item is None:
+            item = _items.setdefault(key, cls(*args))
+
+        return item
 
     @abstractmethod
-    def generate(self) -> dict:
+    def data(self) -> dict:
+        return {}
+
+    def generate(self, slot: int) -> dict:
         return {
             "item": {
                 "id": self.id,
-                "data": {}
+                "data": self.data()
             },
-            "slot": self.slot
+            "slot": slot
         }
 
+    def encode(self, slot: int) -> str:
+        if self._json is None:
+            object.__setattr__(self, "_json", f'{{"id": {_json_str(self.id)}, "data": {{{self._encode_data()}}}}}')
+
+        return f'{{"item": {self._json}, "slot": {slot}}}'
+
+    def _encode_data(self) -> str:
+        return ""
+
+# interned items, keyed by (class, args, arg types)
+_items: "weakref.WeakValueDictionary[tuple, Item]" = weakref.WeakValueDictionary()
+
+@dataclass(frozen=True, slots=True)
 class TagItem(Item):
     block: str
     action: str
     tag: str
     option: str = None
+    id: ClassVar[str] = "bl_tag"
 
-    def __init__(self, slot: int, block: str, action: str, tag: str) -> None:
-        super().__init__(slot = slot)
-        self.id = "bl_tag"
-        self.block = block
-        self.action = action
-        self.tag = tag
+    def data(self) -> dict:
+        return {"block": self.block, "action": self.action, "option": self.option, "tag": self.tag}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-
-        obj["item"]["data"]["block"] = self.block
-        obj["item"]["data"]["action"] = self.action
-        obj["item"]["data"]["option"] = self.option
-        obj["item"]["data"]["tag"] = self.tag
-        
-        return obj
+    def _encode_data(self) -> str:
+        return f'"block": {_json_str(self.block)}, "action": {_json_str(self.action)}, "option": {_json(self.option)}, "tag": {_json_str(self.tag)}'
 
 
+@dataclass(frozen=True, slots=True)
 class StringItem(Item):
     value: str
+    id: ClassVar[str] = "txt"
 
-    def __init__(self, slot: int, value: str) -> None:
-        super().__init__(slot=slot)
-        self.id = "txt"
-        self.value = value
+    def data(self) -> dict:
+        return {"name": self.value}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["name"] = self.value
-        return obj
+    def _encode_data(self) -> str:
+        return f'"name": {_json_str(self.value)}'
     
+@dataclass(frozen=True, slots=True)
 class NumberItem(Item):
     value: float
+    id: ClassVar[str] = "num"
 
-    def __init__(self, slot: int, value: float) -> None:
-        super().__init__(slot=slot)
-        self.id = "num"
-        self.value = value
+    def data(self) -> dict:
+        return {"name": str(self.value)}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["name"] = str(self.value)
-        return obj
+    def _encode_data(self) -> str:
+        return f'"name": {_json_str(str(self.value))}'
     
 # NEW NAME: TEXT
+@dataclass(frozen=True, slots=True)
 class StyledTextItem(Item):
     value: str
+    id: ClassVar[str] = "comp"
 
-    def __init__(self, slot: int, value: str) -> None:
-        super().__init__(slot=slot)
-        self.id = "comp"
-        self.value = value
+    def data(self) -> dict:
+        return {"name": self.value}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["name"] = self.value
-        return obj
+    def _encode_data(self) -> str:
+        return f'"name": {_json_str(self.value)}'
     
+@dataclass(frozen=True, slots=True)
 class VariableItem(Item):
     name: str
     scope: str
+    id: ClassVar[str] = "var"
 
-    def __init__(self, slot: int, name: str, scope: str) -> None:
-        super().__init__(slot=slot)
-        self.id = "var"
-        self.name = name
-        self.scope = scope
+    def data(self) -> dict:
+        return {"name": self.name, "scope": self.scope}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["name"] = self.name
-        obj["item"]["data"]["scope"] = self.scope
-        return obj
+    def _encode_data(self) -> str:
+        return f'"name": {_json_str(self.name)}, "scope": {_json_str(self.scope)}'
     
+@dataclass(frozen=True, slots=True)
 class VectorItem(Item):
     x: float
     y: float
     z: float
+    id: ClassVar[str] = "vec"
 
-    def __init__(self, slot: int, x: float, y: float, z: float) -> None:
-        super().__init__(slot=slot)
-        self.id = "vec"
-        self.x = x
-        self.y = y
-        self.z = z
+    def data(self) -> dict:
+        return {"x": self.x, "y": self.y, "z": self.z}
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["x"] = self.x
-        obj["item"]["data"]["y"] = self.y
-        obj["item"]["data"]["z"] = self.z
-        return obj
+    def _encode_data(self) -> str:
+        return f'"x": {_json(self.x)}, "y": {_json(self.y)}, "z": {_json(self.z)}'
 
+@dataclass(frozen=True, slots=True)
 class ParameterItem(Item):
     name: str
     type: str
     description: str
-    plural: bool
-    optional: bool
-
-    def __init__(self, slot: int, name: str, type: str, desc: str, plural: bool = False, optional: bool = False) -> None:
-        super().__init__(slot=slot)
-        self.id = "pn_el"
-        self.name = name
-        self.type = type
-        self.description = desc
-        self.plural = plural
-        self.optional = optional
+    plural: bool = False
+    optional: bool = False
+    id: ClassVar[str] = "pn_el"
 
-    def generate(self) -> dict:
-        obj = super().generate()
-        obj["item"]["data"]["name"] = self.name
-        obj["item"]["data"]["type"] = self.type
-        obj["item"]["data"]["optional"] = self.optional
-        obj["item"]["data"]["plural"] = self.plural
-        obj["item"]["data"]["description"] = self.description
-        return obj
+    def data(self) -> dict:
+        return {"name": self.name, "type": self.type, "optional": self.optional, "plural": self.plural, "description": self.description}
+
+    def _encode_data(self) -> str:
+        return f'"name": {_json(self.name)}, "type": {_json(self.type)}, "optional": {_json(self.optional)}, "plural": {_json(self.plural)}, "description": {_json(self.description)}'
+
+
+class TagSchema:
+    """Validated tags of one action.
+
+    Holds the allowed options of every tag and the default tags already
+    encoded, so blocks that keep their default tags share the same JSON.
+    generate() always builds new dicts, callers are free to change them.
+    """
+    __slots__ = ("record", "codeblock_name", "options", "defaults", "default_json")
+
+    def __init__(self, registry: ActionRegistry, record: ActionRecord) -> None:
+        self.record = record
+        self.codeblock_name = registry.codeblock(record.codeblock).name
+        self.options = {tag.name: frozenset(tag.options) for tag in record.tags}
+        self.defaults = {tag.name: tag.default_option for tag in record.tags}
+        self._validate(self.defaults)
+        self.default_json = self._encode_items(self.defaults)
+
+    def generate(self, tags: dict) -> List[dict]:
+        # the defaults were validated when the schema was made
+        if tags != self.defaults:
+            self._validate(tags)
+
+        return self._generate_items(tags)
+
+    # the tag items as JSON list entries, joined by ", "
+    def encode(self, tags: dict) -> str:
+        if tags == self.defaults:
+            return self.default_json
+
+        self._validate(tags)
+        return self._encode_items(tags)
+
+    def _validate(self, tags: dict):
+        for tag in self.record.tags:
+            if tags[tag.name] not in self.options[tag.name]:
+                raise ValueError(f"Invalid value '{tags[tag.name]}' of tag '{tag.name}' for action '{self.record.name}' in codeblock '{self.codeblock_name}'")
+
+    def _generate_items(self, tags: dict) -> List[dict]:
+        items = []
+        for tag in self.record.tags:
+            tag_item = TagItem.get(self.record.codeblock, self.record.name, tag.name, tags[tag.name])
+            items.append(tag_item.generate(tag.slot))
+
+        return items
+
+    def _encode_items(self, tags: dict) -> str:
+        items = []
+        for tag in self.record.tags:
+            tag_item = TagItem.get(self.record.codeblock, self.record.name, tag.name, tags[tag.name])
+            items.append(tag_item.encode(tag.slot))
+
+        return ", ".join(items)
+
+# schemas of every registry still in use, keyed by (codeblock, action)
+_tag_schemas: "weakref.WeakKeyDictionary[ActionRegistry, dict[tuple[str, str], TagSchema]]" = weakref.WeakKeyDictionary()
+
+def tag_schema(registry: ActionRegistry, record: ActionRecord) -> TagSchema:
+    schemas = _tag_schemas.get(registry)
+    if schemas is None:
+        schemas = _tag_schemas.setdefault(registry, {})
+
+    schema = schemas.get((record.codeblock, record.name))
+    if schema is None:
+        schema = schemas.setdefault((record.codeblock, record.name), TagSchema(registry, record))
+
+    return schema
+
+
+# items a codeblock's chest holds, arguments and tags together
+CHEST_SLOTS = 27
 
 
 @dataclass
@@ -152,33 +226,35 @@ class Codeblock:
     type: str
     data: str = None # for func, proc, call func, call proc
     action: str = None
-    args: List[Item] = None
+    args: List[Item] = None # an item's slot is its index
     target: str = None
     tags: dict = None
     # tag_items: List[TagItem] = None
+    registry: ActionRegistry = field(default=None, repr=False, compare=False)
+    action_record: ActionRecord = field(default=None, init=False, repr=False, compare=False)
+    tag_schema: TagSchema = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
-        self.tags = {}
+        if self.registry is None:
+            raise ValueError(f"Codeblock '{self.type}' needs an action registry")
 
         # ODD CASES: FUNCTION, PROCESS, CALL FUNCTION, START PROCESS
 
-        cb_name = ACTION_DATA["ids"][self.type]["name"]
-
         if self.type in ('func', 'call_func', 'process', 'start_process'):
             self.action = 'dynamic'
 
-        tag_data = ACTION_DATA["category"][cb_name][self.action]["tags"]
+        self.action_record = self.registry.action(self.type, self.action)
 
-        for tag in tag_data:
-            # tag_item = TagItem(slot=tag["slot"], block=self.type, action=self.action, tag=tag["name"])
-            # tag_item.option = tag["defaultOption"]
+        if self.action_record is None:
+            raise ValueError(f"Unknown action '{self.action}' in codeblock '{self.type}'")
 
-            self.tags[tag["name"]] = tag["defaultOption"]
+        self.tag_schema = tag_schema(self.registry, self.action_record)
+        self.tags = dict(self.tag_schema.defaults)
 
 
     def generate(self) -> dict:
-        args = [arg.generate() for arg in self.args]
-        self._setup_tags(args)
+        args = [arg.generate(slot) for (slot, arg) in enumerate(self.args)]
+        args.extend(self.tag_schema.generate(self.tags))
 
         obj = {
             "id": "block",
@@ -196,39 +272,91 @@ class Codeblock:
             obj["target"] = self.target
             
         return obj
-    
-    def _setup_tags(self, args: List[Item]):
-        cb_name = ACTION_DATA["ids"][self.type]["name"]
-        tag_data = ACTION_DATA["category"][cb_name][self.action]["tags"]
-
-        for tag in tag_data:
-            current_option = self.tags[tag["name"]]
-            for option in tag["options"]:
-                if current_option == option["name"]:
-                    break
-            else:
-                raise ValueError(f"Invalid value '{current_option}' of tag '{tag['name']}' for action '{self.action}' in codeblock '{cb_name}'")
-    
-            tag_item = TagItem(slot=tag["slot"], block=self.type, action=self.action, tag=tag["name"])
-            tag_item.option = current_option
 
-            args.append(tag_item.generate())
+    def encode(self) -> str:
+        items = [arg.encode(slot) for (slot, arg) in enumerate(self.args)]
+        tags = self.tag_schema.encode(self.tags)
+        if tags:
+            items.append(tags)
+
+        out = f'{{"id": "block", "block": {_json_str(self.type)}, "args": {{"items": [{", ".join(items)}]}}'
+
+        if self.data:
+            out += f', "data": {_json_str(self.data)}'
+
+        if self.action and self.action != 'dynamic':
+            out += f', "action": {_json_str(self.action)}'
+
+        if self.target:
+            out += f', "target": {_json_str(self.target)}'
+
+        return out + "}"
 
 @dataclass
 class Codeline:
     blocks: List[Codeblock]
+    template: str = field(default=None, repr=False, compare=False) # encoded by template_data
 
     def append(self, block: Codeblock):
         self.blocks.append(block)
+        self.template = None
 
     def generate(self) -> List[dict]:
         return [block.generate() for block in self.blocks]
 
+    # writes the JSON of {"blocks": generate()} to `f` (binary), one block at a time
+    def write_json(self, f):
+        f.write(b'{"blocks": [')
+        for i, block in enumerate(self.blocks):
+            if i: f.write(b", ")
+            f.write(block.encode().encode("utf-8"))
+        f.write(b"]}")
+
     # Use this to return base64 template data
     def template_data(self):
-        compressed = gzip.compress(json.dumps({"blocks": self.generate()}).encode('utf-8'))
-        return base64.b64encode(compressed).decode("utf-8")
+        if self.template is None:
+            compressed = io.BytesIO()
+            # blocks are small, buffered so zlib gets them in bigger chunks. No
+            # timestamp in the header, the same code always gives the same template
+            with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as gz, io.BufferedWriter(gz, 1 << 16) as f:
+                self.write_json(f)
+
+            self.template = base64.b64encode(compressed.getvalue()).decode("utf-8")
+
+        return self.template
 
     # _nbt is only used internally
     def _nbt(self, curslot):
-        return f"""{{id: "minecraft:ender_chest", Slot: {curslot}b, Count:1b, tag:{{display:{{Name:'{{"text":"Template #{curslot + 1}", "color": "aqua"}}'}}, PublicBukkitValues:{{"hypercube:codetemplatedata":'{{"author":"DFCompiler","name":"&bDFCompiler Template","version":1,"code":"{self.template_data()}"}}'}}}}}}"""
\ No newline at end of file
+        return f"""{{id: "minecraft:ender_chest", Slot: {curslot}b, Count:1b, tag:{{display:{{Name:'{{"text":"Template #{curslot + 1}", "color": "aqua"}}'}}, PublicBukkitValues:{{"hypercube:codetemplatedata":'{{"author":"DFCompiler","name":"&bDFCompiler Template","version":1,"code":"{self.template_data()}"}}'}}}}}}"""
+
+@dataclass
+class GeneratedCodeline(Codeline):
+    """Codeline with its blocks already generated into `data`, like the ones
+    loaded from the codegen cache (those don't have any blocks)."""
+    data: List[dict] = None
+
+    def append(self, block: Codeblock):
+        raise TypeError("Generated codelines can't be changed")
+
+    def generate(self) -> List[dict]:
+        return self.data
+
+    def write_json(self, f):
+        f.write(json.dumps({"blocks": self.data}).encode("utf-8"))
+
+
+def encode_templates(lines: List[Codeline], workers: int = None) -> List[str]:
+    """Template data of every codeline, in the same order as `lines`.
+
+    Codelines are encoded on a pool of `workers` threads (the executor's
+    default when None). Compressing is most of the work and zlib releases the
+    GIL while it runs, so the threads actually run in parallel.
+    """
+    pending = [line for line in lines if line.template is None]
+
+    if workers != 1 and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # template_data keeps its result on the codeline
+            for _ in pool.map(lambda line: line.template_data(), pending): pass
+
+    return [line.template_data() for line in lines]
@@ -1,44 +1,66 @@
 from . import nodes
 from .scanner import TokenLocation, TokenType
-from typing import List
+from typing import Iterable, Iterator, List
 from dataclasses import dataclass
-import json
+from types import GeneratorType
+import hashlib, io, sys
+from concurrent.futures import ProcessPoolExecutor
 from . import diamondfire as df
+from .actiondump import ActionRecord, ActionRegistry, build_action_registry, load_action_registry, read_action_dump
+from .resolver import FunctionSymbol, Resolver
+from . import codecache, ir, passes
 
 
-class Environment:
-    parent: object
-    variables: dict[str, tuple[nodes.Type, str, bool]] # type, scope, is out
-    functions: dict[str, nodes.FuncDefinition]
+class ArgumentMatcher:
+    """A parameter list compiled into a small automaton over argument types.
 
-    def __init__(self, parent: object):
-        self.parent = parent
-        self.variables = {}
-        self.functions = {}
+    States are parameter indices (-1 before the first argument). Feeding an
+    argument moves to the parameter it binds to, skipping over plural and
+    optional parameters it doesn't fit. Transitions are cached per (state,
+    argument key), so every call after the first is a dict lookup.
+    """
+    def __init__(self, params: list[tuple[object, bool, bool]], accepts) -> None:
+        self.params = tuple(params) # (expected, plural, optional)
+        self.accepts = accepts # (expected, arg) -> bool
+        self.last = len(self.params) - 1
+        self.transitions = {}
 
-    def get(self, var: str):
-        if var in self.variables:
-            return self.variables[var]
-        
-        if self.parent:
-            return self.parent.get(var)
-        
-        return None
-    
-    def define(self, var: str, var_type: nodes.Type, scope: str, is_out: bool = False):
-        self.variables[var] = (var_type, scope, is_out)
+    def step(self, state: int, arg, key = None) -> tuple[int, bool]:
+        """Returns the next state and whether `arg` was accepted, on failure the
+        state is the parameter that rejected it. Only steps with a `key` are cached."""
+        if key is None:
+            return self._transition(state, arg)
 
-    def get_func(self, name: str):
-        if name in self.functions:
-            return self.functions[name]
-        
-        if self.parent:
-            return self.parent.get_func(name)
-        
-        return None
+        transition = self.transitions.get((state, key))
+        if transition is None:
+            transition = self.transitions[(state, key)] = self._transition(state, arg)
+
+        return transition
+
+    def _transition(self, state: int, arg) -> tuple[int, bool]:
+        # plural parameters keep taking arguments, the last one takes the rest
+        if state == -1 or (not self.params[state][1] and state != self.last):
+            state += 1
+
+        (expected, plural, optional) = self.params[state]
+        if self.accepts(expected, arg):
+            return (state, True)
+
+        if (plural or optional) and state != self.last:
+            state += 1
+            return (state, self.accepts(self.params[state][0], arg))
+
+        return (state, False)
 
 
 class Generator:
+    # generated functions are cached here when set, see codecache
+    cache_dir: str = None
+    # processes function bodies are generated in, see _generate_parallel
+    workers: int = 1
+    # passes enabled for every function, see ir.PassManager and dfc.passes
+    optimization_level: int = 2
+
     scope_bindings = {
         "line": "line",
         "var": "line",
@@ -91,249 +113,294 @@ class Generator:
         "shooter": "Shooter"
     }
 
+    # the dump's JSON, as text or bytes
     def set_action_data(self, df_action_dump):
-        self.action_data = {
-            "category": {},
-            "ids": {}
-        }
+        if isinstance(df_action_dump, str):
+            df_action_dump = df_action_dump.encode("utf-8")
 
-        df_data = json.loads(df_action_dump)
-        for action in df_data["actions"]:
-            if not action["codeblockName"] in self.action_data["category"]:
-                self.action_data["category"][action["codeblockName"]] = {}
+        digest = hashlib.sha256(df_action_dump).hexdigest()
+        self.set_registry(build_action_registry(read_action_dump(df_action_dump), digest))
 
-            self.action_data["category"][action["codeblockName"]][action["name"]] = action
+    def load_action_data(self, path: str, cache_dir: str = None):
+        self.set_registry(load_action_registry(path, cache_dir))
 
-        for cb in df_data["codeblocks"]:
-            if cb["name"] in self.action_data["category"]:
-                self.action_data["category"][cb["name"]]["id"] = cb["identifier"]
-
-            if cb["identifier"] not in self.action_data["ids"]:
-                self.action_data["ids"][cb["identifier"]] = cb
-        
-        df.ACTION_DATA = self.action_data
+    # registries are read-only, the same one can be given to any number of generators
+    def set_registry(self, registry: ActionRegistry):
+        self.registry = registry
+        self.action_matchers: dict[tuple[str, str], ArgumentMatcher] = {}
 
     def generate(self, tree) -> List[List[dict]]:
         if not isinstance(tree, nodes.TopDefinitions):
             raise ValueError("Tree must be definitions")
         
-        self.env = Environment(parent=None)
-        self.code_lines: List[df.Codeline] = []
-        self.current_line: df.Codeline = None
-        
-        for definition in tree.definitions:
-            if isinstance(definition, nodes.VarDefintion):
-                self.env.define(definition.name, definition.type, definition.scope)
+        # every name is bound to its symbol up front, undefined names are
+        # reported before any code is generated
+        Resolver().resolve(tree)
+        self._reset()
 
-            elif isinstance(definition, nodes.FuncDefinition):
-                self._generate_node(definition)
+        functions = [definition for definition in tree.definitions if isinstance(definition, nodes.FuncDefinition)]
+
+        if self.workers > 1 and sum(func.body is not None for func in functions) > 1:
+            self._generate_parallel(tree, functions)
+            return self.code_lines
+
+        for func in functions:
+            self._generate_node(func)
 
         return self.code_lines
 
+    def generate_stream(self, definitions: Iterable) -> Iterator[df.Codeline]:
+        """Generates top level definitions as they come in (like from
+        Parser.parse_iter), yielding each function's codeline as soon as it's
+        done. Names are resolved per definition, so an undefined name is only
+        reported when its function is reached. Nothing is kept of a function
+        once its codeline has been yielded."""
+        resolver = Resolver()
+        resolver.reset()
+        self._reset()
+
+        for definition in definitions:
+            resolver.resolve_definition(definition)
+
+            if isinstance(definition, nodes.FuncDefinition):
+                self._generate_node(definition)
+
+                if self.code_lines:
+                    self.current_function = None
+                    yield self.code_lines.pop()
 
-    def _generate_node(self, node, expr_var_name: str = "__dfc_res"):
+    def _reset(self):
+        self.func_matchers: dict[FunctionSymbol, ArgumentMatcher] = {}
+        # compare_types results for data-less (interned) types, keyed by (expected, actual)
+        self.type_matches: dict[tuple[nodes.Type, nodes.Type], bool] = {}
+        self.code_lines: List[df.Codeline] = []
+        self.current_function: ir.Function = None
+        self.pass_manager = ir.PassManager(self.optimization_level)
+
+    def _generate_parallel(self, tree: nodes.TopDefinitions, functions: List[nodes.FuncDefinition]):
+        # Names and signatures are already resolved, so the only thing a
+        # function body needs from the others is their signatures. Every
+        # worker gets the resolved tree once and generates the bodies it's
+        # handed by index, results come back in definition order so the
+        # output is the same as generating them one after another.
+        bodies = [i for (i, func) in enumerate(functions) if func.body is not None]
+        chunksize = max(1, len(bodies) // (self.workers * 4))
+
+        with ProcessPoolExecutor(
+            max_workers=min(self.workers, len(bodies)),
+            initializer=_init_worker,
+            initargs=(self.registry, self.cache_dir, self.optimization_level, tree)
+        ) as pool:
+            for (data, template) in pool.map(_generate_function, bodies, chunksize=chunksize):
+                self.code_lines.append(df.GeneratedCodeline(blocks=[], template=template, data=data))
+
+
+    # Expressions put their result in `dest`, or in a new temporary without
+    # one. Expressions can nest deeper than Python's recursion limit, so the
+    # methods of nodes made of other expressions (operations, indexes, casts)
+    # are generators: they yield (node, dest) for each operand and are sent
+    # its (type, dfitem), their frames are kept on a stack here.
+    def _generate_node(self, node, dest: df.VariableItem = None):
+        stack = []
+        value = self._generate_method(node)(node, dest)
+
+        while True:
+            if isinstance(value, GeneratorType):
+                stack.append(value)
+                value = None
+
+            elif not stack:
+                return value
+
+            try:
+                (node, dest) = stack[-1].send(value)
+            except StopIteration as done:
+                stack.pop()
+                value = done.value
+                continue
+
+            value = self._generate_method(node)(node, dest)
+
+    def _generate_method(self, node):
         name = type(node).__name__
         method = getattr(self, f"_generate_{name}", None)
 
         if not method:
             raise NotImplementedError(f"Generator for node type '{name}' hasn't been implemented.")
 
-        return method(node, expr_var_name)
+        return method
+
+    def _declare_function(self, node: nodes.FuncDefinition):
+        self.func_matchers[node.symbol] = ArgumentMatcher(
+            [(arg[1], arg[3], arg[2]) for arg in node.args],
+            self.compare_types
+        )
 
-    def _generate_FuncDefinition(self, node: nodes.FuncDefinition, expr_var_name: str):
-        self.env.functions[node.name] = node
+    def _generate_FuncDefinition(self, node: nodes.FuncDefinition, dest: df.VariableItem):
+        self._declare_function(node)
 
         # external definition
         if node.body == None: return
 
-        self.env = Environment(parent=self.env)
+        # only dumps with a known hash can be part of a cache key
+        key = None
+        if self.cache_dir is not None and self.registry.digest is not None:
+            key = codecache.function_key(node, self.registry.digest, self.optimization_level)
+            cached = codecache.load_function(self.cache_dir, key)
+
+            if cached is not None:
+                (data, template) = cached
+                self.code_lines.append(df.GeneratedCodeline(blocks=[], template=template, data=data))
+                return
 
-        self.current_line = df.Codeline(blocks=[])
-        func_block = df.Codeblock(type='func', data=node.name, args=[])
+        self.current_function = ir.Function(name=node.name, params=[], body=[])
 
         # generate arguments
         for i, arg in enumerate(node.args):
-            # if it's plural it should be a list
-            if arg[3]:
-                self.env.define(arg[0], nodes.Type(name='list', parameters=[arg[1]]), "line", arg[4])
-            else:
-                self.env.define(arg[0], arg[1], "line", arg[4])
-
             arg_item = df.ParameterItem(
-                slot=i,
                 name=arg[0],
                 type="var" if arg[4] else self.type_bindings[arg[1].name], # if its an out var use 'var' otherwise use the proper type
-                desc=f"Argument #{i + 1}" if arg[5] == None else arg[5],
+                description=f"Argument #{i + 1}" if arg[5] == None else arg[5],
                 plural=arg[3],
                 optional=arg[2]
             )
 
-            func_block.args.append(arg_item)
-
-
-        self.current_line.append(func_block)
+            self.current_function.params.append(arg_item)
 
         # generate body
         for stmt in node.body:
-            self._generate_node(stmt)
+            try:
+                self._generate_node(stmt)
+            except RecursionError:
+                # only literal lists and dictionaries nested in each other still recurse
+                raise GeneratorError(f"Expression is nested too deeply, more than about {sys.getrecursionlimit() // 2} levels", stmt.location) from None
+
+        line = self._lower(self.pass_manager.run(self.current_function))
+
+        if key is not None:
+            line = df.GeneratedCodeline(blocks=line.blocks, template=line.template_data(), data=line.generate())
+            codecache.store_function(self.cache_dir, key, line.data, line.template)
 
         # add code line to list of codelines
-        self.code_lines.append(self.current_line)
-        self.env = self.env.parent
+        self.code_lines.append(line)
+
+    def emit(self, instruction: ir.Instruction):
+        self.current_function.body.append(instruction)
 
-    def _generate_VarDefintion(self, node: nodes.VarDefintion, expr_var_name: str):
-        self.env.define(node.name, node.type, node.scope)
+    # where an expression puts its result, a new temporary if it isn't assigned to a variable
+    def _result(self, dest: df.VariableItem) -> df.VariableItem:
+        return self.current_function.temp() if dest is None else dest
 
+    def _lower(self, function: ir.Function) -> df.Codeline:
+        blocks = [df.Codeblock(type='func', data=function.name, args=function.params, registry=self.registry)]
+
+        for inst in function.body:
+            blocks.append(df.Codeblock(type=inst.type, registry=self.registry, data=inst.data, action=inst.action, args=inst.args, target=inst.target))
+
+        return df.Codeline(blocks=blocks)
+
+    def _generate_VarDefintion(self, node: nodes.VarDefintion, dest: df.VariableItem):
         if node.value:
+            var_item = df.VariableItem.get(node.name, self.scope_bindings[node.scope])
+
             # should return tuple (type, dfitem)
-            value = self._generate_node(node.value, expr_var_name=node.name)
+            value = self._generate_node(node.value, dest=var_item)
 
             if not self.compare_types(node.type, value[0]):
                 raise GeneratorError(f"Assigning a value of type '{value[0]}' to variable defined as '{node.type}'", node.location)
             
-            if not isinstance(value[1], df.VariableItem):
-                value[1].slot = 1
-                self.current_line.append(df.Codeblock(
+            if value[1] is not var_item:
+                self.emit(ir.Instruction(
                     type='set_var',
                     action="=",
                     args=[
-                        df.VariableItem(slot=0, name=node.name, scope=self.scope_bindings[node.scope]),
+                        var_item,
                         value[1]
                     ]
                 ))
 
-    def _generate_AssignVar(self, node: nodes.AssignVar, expr_var_name: str):
-        var_data = self.env.get(node.name)
-
-        if not var_data:
-            raise GeneratorError(f"Assigning an undefined variable '{node.name}'", node.location)
+    def _generate_AssignVar(self, node: nodes.AssignVar, dest: df.VariableItem):
+        var_data = node.symbol
+        var_item = df.VariableItem.get(node.name, self.scope_bindings[var_data.scope])
 
         # tuple (type, dfitem)
-        value = self._generate_node(node.value, expr_var_name=node.name)
+        value = self._generate_node(node.value, dest=var_item)
 
-        if not self.compare_types(var_data[0], value[0]):
-            #raise GeneratorError(f"Assigning a value of type '{value[0].name}' to variable defined as '{var_data[0].name}'", node.location)
-            raise GeneratorError(f"Assigning a value of type '{value[0]}' to variable defined as '{var_data[0]}'", node.location)
+        if not self.compare_types(var_data.type, value[0]):
+            #raise GeneratorError(f"Assigning a value of type '{value[0].name}' to variable defined as '{var_data.type.name}'", node.location)
+            raise GeneratorError(f"Assigning a value of type '{value[0]}' to variable defined as '{var_data.type}'", node.location)
         
-        if not isinstance(value[1], df.VariableItem):
-            value[1].slot = 1
-            self.current_line.append(df.Codeblock(
+        if value[1] is not var_item:
+            self.emit(ir.Instruction(
                     type='set_var',
                     action="=",
                     args=[
-                        df.VariableItem(slot=0, name=node.name, scope=self.scope_bindings[var_data[1]]),
+                        var_item,
                         value[1]
                     ]
                 ))
 
-    def _generate_CallFunction(self, node: nodes.CallFunction, expr_var_name: str):
-        func_data = self.env.get_func(node.name)
-
-        if not func_data:
-            raise GeneratorError(f"Undefined function '{node.name}'", node.location)
+    def _generate_CallFunction(self, node: nodes.CallFunction, dest: df.VariableItem):
+        func_data = node.symbol
 
         if len(func_data.args) == 0 and len(node.args) != 0:
             raise GeneratorError(f"Function '{node.name}' takes no arguments", node.location)
                 
-        func_arg_iter = enumerate(func_data.args)
-        current_func_arg = None
-        is_plural = False
-        is_optional = False
-        is_last = False
+        matcher = self.func_matchers[node.symbol]
+        state = -1
         evaluated_args = []
         for i, arg in enumerate(node.args):
             # (type, dfitem)
-            value = self._generate_node(arg, expr_var_name=f'__carg_{i}')
+            value = self._generate_node(arg)
             arg_type: nodes.Type = value[0]
             dfitem: df.Item = value[1]
 
-            # type checking
-            if not is_plural and (not is_last):
-                current_func_arg = next(func_arg_iter)
-                is_plural = current_func_arg[1][3]
-                is_optional = current_func_arg[1][2]
-
-                if current_func_arg[0] == len(func_data.args) - 1:
-                    is_last = True
-                
-            if not self.compare_types(current_func_arg[1][1], arg_type):
-                if (is_plural or is_optional) and not is_last:
-                    current_func_arg = next(func_arg_iter)
-                    is_plural = current_func_arg[1][3]
-                    is_optional = current_func_arg[1][2]
-
-                    if current_func_arg[0] == len(func_data.args) - 1:
-                        is_last = True
+            # type checking, literal dicts and lists are checked entry by entry so they can't be cached
+            (state, accepted) = matcher.step(state, arg_type, arg_type if arg_type.data is None else None)
+            if not accepted:
+                raise GeneratorError(f"Function parameter #{i + 1} expected '{matcher.params[state][0]}' but got '{arg_type}'", node.location)
 
-                    if not self.compare_types(current_func_arg[1][1], arg_type):
-                        raise GeneratorError(f"Function parameter #{i + 1} expected '{current_func_arg[1][1]}' but got '{arg_type}'", node.location)
-
-                else:
-                    raise GeneratorError(f"Function parameter #{i + 1} expected '{current_func_arg[1][1]}' but got '{arg_type}'", node.location)
-
-            dfitem.slot = i
             evaluated_args.append(dfitem)
 
-        self.current_line.append(df.Codeblock(
+        self.emit(ir.Instruction(
             type="call_func",
             data=node.name,
             args = evaluated_args
         ))
 
-    def _generate_CallCB(self, node: nodes.CallCB, expr_var_name: str):
-        if node.codeblock.category not in self.action_data["category"]:
+    def _generate_CallCB(self, node: nodes.CallCB, dest: df.VariableItem):
+        codeblock = self.registry.codeblock_by_name(node.codeblock.category)
+        if not codeblock:
             raise GeneratorError(f"Unknown codeblock category '{node.codeblock.category}'", node.location)
 
-        if node.codeblock.action not in self.action_data["category"][node.codeblock.category]:
+        action_data = self.registry.action(codeblock.identifier, node.codeblock.action)
+        if not action_data:
             raise GeneratorError(f"Unknown action '{node.codeblock.action}' in codeblock category '{node.codeblock.category}'", node.location)
 
-        action_data = self.action_data["category"][node.codeblock.category][node.codeblock.action]
-        arg_data = action_data["icon"]["arguments"]
-
+        if len(action_data.arguments) == 0 and len(node.args) != 0:
+            raise GeneratorError(f"Action '{node.codeblock.action}' takes no arguments", node.location)
 
-        cb_arg_iter = enumerate(arg_data)
-        current_cb_arg = None
-        is_plural = False
-        is_optional = False
-        is_last = False
+        matcher = self._action_matcher(action_data)
+        state = -1
         evaluated_args = []
         for i, arg in enumerate(node.args):
             # (type, dfitem)
 
-            value = self._generate_node(arg, expr_var_name=f'__carg_{i}')
+            value = self._generate_node(arg)
             arg_type: nodes.Type = value[0]
             dfitem: df.Item = value[1]
 
             # type checking
-            if not is_plural and (not is_last):
-                current_cb_arg = next(cb_arg_iter)
-                is_plural = current_cb_arg[1]["plural"]
-                is_optional = current_cb_arg[1]["optional"]
-
-                if current_cb_arg[0] == len(arg_data) - 1:
-                    is_last = True
-
-            if not (current_cb_arg[1]["type"] == "VARIABLE" and type(arg) is nodes.Variable):
-                if not self.compare_types_simple(current_cb_arg[1]["type"], self.arg_type_bindings[arg_type.name]):
-                    if (is_plural or is_optional) and not is_last:
-                        current_cb_arg = next(cb_arg_iter)
-                        is_plural = current_cb_arg[1]["plural"]
-                        is_optional = current_cb_arg[1]["optional"]
-
-                        if current_cb_arg[0] == len(arg_data) - 1:
-                            is_last = True
+            key = (self.arg_type_bindings[arg_type.name], type(arg) is nodes.Variable)
+            (state, accepted) = matcher.step(state, key, key)
+            if not accepted:
+                expected = matcher.params[state][0]
+                raise GeneratorError(f"Codeblock parameter #{i + 1} expected '{self.arg_type_bindings_inv.get(expected, expected)}' but got '{arg_type}'", node.location)
 
-                        if not self.compare_types_simple(current_cb_arg[1]["type"], self.arg_type_bindings[arg_type.name]):
-                            raise GeneratorError(f"Codeblock parameter #{i + 1} expected '{self.arg_type_bindings_inv[current_cb_arg[1]['type']]}' but got '{arg_type}'", node.location)
-
-                    else:
-                        raise GeneratorError(f"Codeblock parameter #{i + 1} expected '{self.arg_type_bindings_inv[current_cb_arg[1]['type']]}' but got '{arg_type}'", node.location)
-
-            dfitem.slot = i
             evaluated_args.append(dfitem)
 
-        block = df.Codeblock(
-            type=self.action_data["category"][node.codeblock.category]["id"],
+        block = ir.Instruction(
+            type=codeblock.identifier,
             action=node.codeblock.action,
             args=evaluated_args
         )
@@ -341,11 +408,12 @@ class Generator:
         if node.codeblock.target:
             block.target = self.target_bindings[node.codeblock.target]
 
-        self.current_line.append(block)
+        self.emit(block)
 
-    def _generate_BinaryOperation(self, node: nodes.BinaryOperation, expr_var_name: str):
-        left = self._generate_node(node.left, expr_var_name="__bin_l")
-        right = self._generate_node(node.right, expr_var_name="__bin_r")
+    # generator, see _generate_node
+    def _generate_BinaryOperation(self, node: nodes.BinaryOperation, dest: df.VariableItem):
+        left = yield (node.left, None)
+        right = yield (node.right, None)
 
         # TODO: MAKE WORK WITH OTHER TYPES (STR, COMBINING LISTS, VECTOR)
         if right[0].name != "num" or left[0].name != "num":
@@ -369,50 +437,48 @@ class Generator:
             case TokenType.ARROW_UP:
                 action = "Exponent"
 
-        left[1].slot = 1
-        right[1].slot = 2
-
-        self.current_line.append(df.Codeblock(
+        result = self._result(dest)
+        self.emit(ir.Instruction(
             type='set_var',
             action=action,
             args=[
-                df.VariableItem(slot=0, name=expr_var_name, scope='line'),
+                result,
                 left[1],
                 right[1]
             ]
         ))
 
-        return (nodes.Type(name='num', parameters=[]), df.VariableItem(slot=0, name=expr_var_name, scope='line'))
+        return (nodes.Type.get('num'), result)
     
-    def _generate_Index(self, node: nodes.Index, expr_var_name: str):
+    # generator, see _generate_node
+    def _generate_Index(self, node: nodes.Index, dest: df.VariableItem):
         # (type, dfitem)
-        (obj_type, obj_item) = self._generate_node(node.obj)
+        (obj_type, obj_item) = yield (node.obj, None)
         
         # TODO: Allow indexing into vector (.x, .y, .z)
         if obj_type.name not in ("str", "dict", "list"):
             raise GeneratorError(f"Cannot index into object of type '{obj_type}'", node.location)
 
-        (idx_type, idx_item) = self._generate_node(node.index, expr_var_name='__idx')
+        (idx_type, idx_item) = yield (node.index, None)
+        dest = self._result(dest)
 
         # TODO: Make this smaller, a lot of code is similar or same
         if obj_type.name == 'dict':
             if idx_type.name != 'str':
                 raise GeneratorError(f"Cannot index into dictionary with key of type '{idx_type}' (must be a str)", node.location)
             
-            obj_item.slot = 1
-            idx_item.slot = 2
-            self.current_line.append(df.Codeblock(
+            self.emit(ir.Instruction(
                 type='set_var',
                 action='GetDictValue',
                 args=[
-                    df.VariableItem(slot=0, name=expr_var_name, scope='line'),
+                    dest,
                     obj_item,
                     idx_item
                 ]
             ))
 
-            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type(name='any', parameters=[])
-            return (expected_type, df.VariableItem(slot=0, name=expr_var_name, scope='line'))
+            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type.get('any')
+            return (expected_type, dest)
 
         elif obj_type.name == 'list':
             # TODO: if str, check if it's a list function (.pop, .insert, .append, .sort, .expand, .index, .reverse, .trim) 
@@ -421,26 +487,24 @@ class Generator:
             if idx_type.name != 'num':
                 raise GeneratorError(f"Cannot index into list with key of type '{idx_type}' (must be a num)", node.location)
             
-            obj_item.slot = 1
-            idx_item.slot = 2
-            self.current_line.append(df.Codeblock(
+            self.emit(ir.Instruction(
                 type='set_var',
                 action='GetListValue',
                 args=[
-                    df.VariableItem(slot=0, name=expr_var_name, scope='line'),
+                    dest,
                     obj_item,
                     idx_item
                 ]
             ))
 
-            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type(name='any', parameters=[])
-            return (expected_type, df.VariableItem(slot=0, name=expr_var_name, scope='line'))
+            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type.get('any')
+            return (expected_type, dest)
 
         elif obj_type.name == 'str':
             pass
 
 
-    def _generate_SetIndex(self, node: nodes.SetIndex, expr_var_name: str):
+    def _generate_SetIndex(self, node: nodes.SetIndex, dest: df.VariableItem):
         # (type, dfitem)
         (obj_type, obj_item) = self._generate_node(node.obj)
         
@@ -448,22 +512,19 @@ class Generator:
         if obj_type.name not in ("dict", "list"):
             raise GeneratorError(f"Cannot index into object of type '{obj_type}'", node.location)
 
-        (idx_type, idx_item) = self._generate_node(node.index, expr_var_name='__idx')
-        (value_type, value_item) = self._generate_node(node.value, expr_var_name='__value')
+        (idx_type, idx_item) = self._generate_node(node.index)
+        (value_type, value_item) = self._generate_node(node.value)
 
         if obj_type.name == 'dict':
             if idx_type.name != 'str':
                 raise GeneratorError(f"Cannot index into dictionary with key of type '{idx_type}' (must be a str)", node.location)
             
             # compare types
-            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type(name='any', parameters=[])
+            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type.get('any')
             if not self.compare_types(expected_type, value_type):
                 raise GeneratorError(f"Dictionary expected value of type '{expected_type}' but instead got '{value_type}'", node.location)
 
-            #obj_item.slot = 0
-            idx_item.slot = 1
-            value_item.slot = 2
-            self.current_line.append(df.Codeblock(
+            self.emit(ir.Instruction(
                 type='set_var',
                 action='SetDictValue',
                 args=[
@@ -481,14 +542,11 @@ class Generator:
                 raise GeneratorError(f"Cannot index into list with key of type '{idx_type}' (must be a num)", node.location)
             
             # compare types
-            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type(name='any', parameters=[])
+            expected_type = obj_type.parameters[0] if len(obj_type.parameters) != 0 else nodes.Type.get('any')
             if not self.compare_types(expected_type, value_type):
                 raise GeneratorError(f"List expected value of type '{expected_type}' but instead got '{value_type}'", node.location)
 
-            #obj_item.slot = 0
-            idx_item.slot = 1
-            value_item.slot = 2
-            self.current_line.append(df.Codeblock(
+            self.emit(ir.Instruction(
                 type='set_var',
                 action='SetListValue',
                 args=[
@@ -500,88 +558,114 @@ class Generator:
 
             return (value_type, value_item)
 
-    def _generate_Cast(self, node: nodes.Cast, expr_var_name: str):
-        (val_type, dfitem) = self._generate_node(node.value)
+    # generator, see _generate_node
+    def _generate_Cast(self, node: nodes.Cast, dest: df.VariableItem):
+        (val_type, dfitem) = yield (node.value, None)
+
+        # types are shared, so literal data is carried over onto a new one
+        if val_type.data is not None:
+            return (nodes.Type(name=node.type.name, parameters=node.type.parameters, data=val_type.data), dfitem)
 
-        node.type.data = val_type.data
         return (node.type, dfitem)
 
-    def _generate_Variable(self, node: nodes.Variable, expr_var_name: str):
+    def _generate_Variable(self, node: nodes.Variable, dest: df.VariableItem):
         # TODO: Check if scope is not None
-
-        # check if defined
-        var_type = self.env.get(node.name)
-        if not var_type:
-            raise GeneratorError(f"Undefined variable '{node.name}'", node.location)
-
-        return (var_type[0], df.VariableItem(slot=0, name=node.name, scope=self.scope_bindings[var_type[1]]))
+        symbol = node.symbol
+        return (symbol.type, df.VariableItem.get(node.name, self.scope_bindings[symbol.scope]))
     
-    def _generate_NumberValue(self, node: nodes.NumberValue, expr_var_name: str):
-        return (nodes.Type(name='num', parameters=[]), df.NumberItem(slot=0, value=node.value))
+    def _generate_NumberValue(self, node: nodes.NumberValue, dest: df.VariableItem):
+        return (nodes.Type.get('num'), df.NumberItem.get(node.value))
     
-    def _generate_StringValue(self, node: nodes.StringValue, expr_var_name: str):
-        return (nodes.Type(name='str', parameters=[]), df.StringItem(slot=0, value=node.value))
+    def _generate_StringValue(self, node: nodes.StringValue, dest: df.VariableItem):
+        return (nodes.Type.get('str'), df.StringItem.get(node.value))
     
-    def _generate_StyledTextValue(self, node: nodes.StyledTextValue, expr_var_name: str):
-        return (nodes.Type(name='txt', parameters=[]), df.StyledTextItem(slot=0, value=node.value))
+    def _generate_StyledTextValue(self, node: nodes.StyledTextValue, dest: df.VariableItem):
+        return (nodes.Type.get('txt'), df.StyledTextItem.get(node.value))
     
-    def _generate_VectorValue(self, node: nodes.VectorValue, expr_var_name: str):
-        return (nodes.Type(name='vec', parameters=[]), df.VectorItem(slot=0, x=node.x, y=node.y, z=node.z))
+    def _generate_VectorValue(self, node: nodes.VectorValue, dest: df.VariableItem):
+        return (nodes.Type.get('vec'), df.VectorItem.get(node.x, node.y, node.z))
     
-    def _generate_Dictionary(self, node: nodes.Dictionary, expr_var_name: str):
-        self.current_line.append(df.Codeblock(
+    def _generate_Dictionary(self, node: nodes.Dictionary, dest: df.VariableItem):
+        data = []
+        # values are evaluated first, they may read the variable the dictionary replaces
+        for (key, value) in node.data:
+            data.append((key, self._generate_node(value)))
+
+        # a value that is the variable itself would be read after it's replaced
+        if any(evaluated_value[1] is dest for (key, evaluated_value) in data):
+            dest = None
+
+        dest = self._result(dest)
+        self.emit(ir.Instruction(
             type = 'set_var',
             action = 'CreateDict',
             args = [
-                df.VariableItem(slot=0, name=expr_var_name, scope='line')
+                dest
             ]
         ))
 
-
-        data = []
         # set values
-        for (key, value) in node.data:
-            evaluated_value = self._generate_node(value) # using default variable evaluation name, maybe change in future but probably not needed
-            evaluated_value[1].slot = 2
-            
-            self.current_line.append(df.Codeblock(
+        for (key, evaluated_value) in data:
+            self.emit(ir.Instruction(
                 type = 'set_var',
                 action = 'SetDictValue',
                 args = [
-                    df.VariableItem(slot=0, name=expr_var_name, scope='line'),
-                    df.StringItem(slot=1, value=key),
+                    dest,
+                    df.StringItem.get(key),
                     evaluated_value[1]
                 ]
             ))
 
-            data.append((key, evaluated_value))
-
-        return (nodes.Type(name='dict', parameters=[nodes.Type(name='any', parameters=[])], data=data), df.VariableItem(slot=0, name=expr_var_name, scope='line'))
+        return (nodes.Type(name='dict', parameters=(nodes.Type.get('any'),), data=data), dest)
     
     # TODO: List, Potion, Particle, Game Value
-    def _generate_ListValue(self, node: nodes.ListValue, expr_var_name: str):
+    def _generate_ListValue(self, node: nodes.ListValue, dest: df.VariableItem):
         items = []
         data = []
         # items
-        for i, value in enumerate(node.data):
-            evaluated_value = self._generate_node(value, expr_var_name=f"__list_{i}") # using default variable evaluation name, maybe change in future but probably not needed
-            evaluated_value[1].slot = i + 1
+        for value in node.data:
+            evaluated_value = self._generate_node(value)
 
             items.append(evaluated_value[1])
             data.append(evaluated_value)
 
-        self.current_line.append(df.Codeblock(
+        dest = self._result(dest)
+        self.emit(ir.Instruction(
             type = 'set_var',
             action = 'CreateList',
             args = [
-                df.VariableItem(slot=0, name=expr_var_name, scope='line'),
+                dest,
                 *items
             ]
         ))
 
-        return (nodes.Type(name='list', parameters=[nodes.Type(name='any', parameters=[])], data=data), df.VariableItem(slot=0, name=expr_var_name, scope='line'))
+        return (nodes.Type(name='list', parameters=(nodes.Type.get('any'),), data=data), dest)
+
+    def _action_matcher(self, action: ActionRecord) -> ArgumentMatcher:
+        matcher = self.action_matchers.get((action.codeblock, action.name))
+
+        if matcher is None:
+            # arguments are keyed as (DF type, is a plain variable)
+            matcher = self.action_matchers[(action.codeblock, action.name)] = ArgumentMatcher(
+                [(arg.type, arg.plural, arg.optional) for arg in action.arguments],
+                lambda expected, arg: (expected == "VARIABLE" and arg[1]) or self.compare_types_simple(expected, arg[0])
+            )
+
+        return matcher
 
     def compare_types(self, type1: nodes.Type, type2: nodes.Type) -> bool:
+        # interned types are the same object when they're equal, so the result
+        # only depends on their identities, literal data has to be walked
+        if type1.data is not None or type2.data is not None:
+            return self._compare_types(type1, type2)
+
+        matches = self.type_matches.get((type1, type2))
+        if matches is None:
+            matches = self.type_matches[(type1, type2)] = self._compare_types(type1, type2)
+
+        return matches
+
+    def _compare_types(self, type1: nodes.Type, type2: nodes.Type) -> bool:
         if type1.name == 'any': return True
         if type1.name != type2.name: return False
 
@@ -589,10 +673,10 @@ class Generator:
 
         # dictionary checking
         if type1.name == 'dict' and type2.name == 'dict':
-            expected_value_type = type1.parameters[0] if len(type1.parameters) != 0 else nodes.Type(name='any', parameters=[])
+            expected_value_type = type1.parameters[0] if len(type1.parameters) != 0 else nodes.Type.get('any')
 
             if type2.data is None:
-                t2_type = type2.parameters[0] if len(type2.parameters) != 0 else nodes.Type(name='any', parameters=[])
+                t2_type = type2.parameters[0] if len(type2.parameters) != 0 else nodes.Type.get('any')
                 return self.compare_types(expected_value_type, t2_type)
 
             # key (str), value (tuple[type, dfitem])
@@ -603,10 +687,10 @@ class Generator:
             return True
         
         if type1.name == 'list' and type2.name == 'list':
-            expected_value_type = type1.parameters[0] if len(type1.parameters) != 0 else nodes.Type(name='any', parameters=[])
+            expected_value_type = type1.parameters[0] if len(type1.parameters) != 0 else nodes.Type.get('any')
 
             if type2.data is None:
-                t2_type = type2.parameters[0] if len(type2.parameters) != 0 else nodes.Type(name='any', parameters=[])
+                t2_type = type2.parameters[0] if len(type2.parameters) != 0 else nodes.Type.get('any')
                 return self.compare_types(expected_value_type, t2_type)
 
             # value (tuple[type, dfitem])
@@ -628,20 +712,61 @@ class Generator:
         return type1 == type2
 
 
-    def give_command(self):
-        items = []
-        for i, code_line in enumerate(self.code_lines):
-            items.append(code_line._nbt(i))
+    # workers: threads the templates are encoded on, see df.encode_templates
+    def give_command(self, workers: int = None):
+        df.encode_templates(self.code_lines, workers)
+
+        out = io.StringIO()
+        self.write_give_command(out, self.code_lines)
+        return out.getvalue()
 
-        return f"""/give @p minecraft:shulker_box{{BlockEntityTag:{{Items:[{','.join(items)}]}}, display:{{Name:'[{{"text": "DFCompiler Program", "color": "light_purple", "italic": "false"}}]'}}}}"""
+    # writes the give command for `lines` to `out` (text), one codeline at a time,
+    # with generate_stream only one codeline is alive at any point
+    def write_give_command(self, out, lines: Iterable[df.Codeline]):
+        out.write("/give @p minecraft:shulker_box{BlockEntityTag:{Items:[")
+
+        for i, code_line in enumerate(lines):
+            if i: out.write(",")
+            out.write(code_line._nbt(i))
+
+        out.write("""]}, display:{Name:'[{"text": "DFCompiler Program", "color": "light_purple", "italic": "false"}]'}}""")
     
 class GeneratorError(Exception):
     def __init__(self, msg, location: TokenLocation) -> None:
         self.msg = msg
         self.location = location
 
+    # raised in generator worker processes and sent back to the parent
+    def __reduce__(self):
+        return (GeneratorError, (self.msg, self.location))
+
     def __repr__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
 
     def __str__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
\ No newline at end of file
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
+
+
+# state of a worker process of Generator._generate_parallel
+_worker_generator: Generator = None
+_worker_functions: List[nodes.FuncDefinition] = None
+
+def _init_worker(registry: ActionRegistry, cache_dir: str, optimization_level: int, tree: nodes.TopDefinitions):
+    global _worker_generator, _worker_functions
+
+    _worker_generator = Generator()
+    _worker_generator.set_registry(registry)
+    _worker_generator.cache_dir = cache_dir
+    _worker_generator.optimization_level = optimization_level
+    _worker_generator._reset()
+    _worker_functions = [definition for definition in tree.definitions if isinstance(definition, nodes.FuncDefinition)]
+
+    for func in _worker_functions:
+        _worker_generator._declare_function(func)
+
+def _generate_function(index: int) -> tuple[List[dict], str]:
+    _worker_generator.code_lines = []
+    _worker_generator._generate_node(_worker_functions[index])
+
+    line = _worker_generator.code_lines[0]
+    return (line.generate(), line.template_data())
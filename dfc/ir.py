@@ -0,0 +1,72 @@
+from dataclasses import dataclass, field
+from typing import Callable, List
+from . import diamondfire as df
+
+
+@dataclass(slots=True)
+class Instruction:
+    """One DF action, the IR is lowered to exactly one codeblock per
+    instruction. Three-address style: a set_var writes its result to the
+    variable in args[0], the rest of args are its operands."""
+    type: str # codeblock, e.g. 'set_var'
+    action: str = None
+    args: List[df.Item] = field(default_factory=list)
+    data: str = None # function name of call_func
+    target: str = None
+
+# set_var actions that only write args[0] and read the rest of their args
+ASSIGNING_ACTIONS = frozenset(("=", "+", "-", "x", "/", "Exponent", "GetDictValue", "GetListValue", "CreateList", "CreateDict"))
+# set_var actions that change the value in args[0] and only read the rest
+MODIFYING_ACTIONS = frozenset(("SetDictValue", "SetListValue", "AppendValue"))
+
+def assigned(inst: "Instruction") -> df.VariableItem:
+    """The variable `inst` overwrites without reading it, if any. For every
+    other instruction any variable in its args may be read and written."""
+    if inst.type == 'set_var' and inst.action in ASSIGNING_ACTIONS:
+        return inst.args[0]
+
+    return None
+
+
+@dataclass(slots=True)
+class Function:
+    name: str
+    params: List[df.ParameterItem]
+    body: List[Instruction]
+    # line variables the generator introduced, only ever used in this function
+    temporaries: set[df.VariableItem] = field(default_factory=set)
+
+    def temp(self) -> df.VariableItem:
+        """A new temporary, never shared with another expression."""
+        item = df.VariableItem.get(f"__tmp{len(self.temporaries)}", 'line')
+        self.temporaries.add(item)
+        return item
+
+
+# (name, optimization level it's enabled from, pass), run in registration order
+_passes: list[tuple[str, int, Callable[[Function], None]]] = []
+
+def register_pass(name: str, level: int = 1):
+    """Registers a pass, run on every function at optimization `level` and
+    up. A pass takes an ir.Function and changes it in place."""
+    def register(func: Callable[[Function], None]):
+        _passes.append((name, level, func))
+        return func
+
+    return register
+
+
+class PassManager:
+    """Runs the registered passes enabled at an optimization level, level 0
+    runs none at all."""
+    __slots__ = ("level", "passes")
+
+    def __init__(self, level: int) -> None:
+        self.level = level
+        self.passes = [(name, func) for (name, min_level, func) in _passes if level >= min_level]
+
+    def run(self, function: Function) -> Function:
+        for (name, func) in self.passes:
+            func(function)
+
+        return function
@@ -1,13 +1,33 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
 from .scanner import TokenLocation, Token
 
 
-@dataclass
+# Types are immutable and compare by identity. Types without data should be
+# made with Type.get, which hands out one shared instance per structure, so
+# equal types are the same object and type checks can be cached by identity.
+@dataclass(frozen=True, slots=True, eq=False)
 class Type:
     name: str
-    parameters: List[object] # List of types
-    data: object = None
+    parameters: tuple # tuple of types
+    data: object = None # entries of dict/list literals, set by the generator
+
+    @staticmethod
+    def get(name: str, parameters: tuple = ()) -> "Type":
+        parameters = tuple(parameters)
+        key = (name, parameters)
+        typ = _interned_types.get(key)
+
+        if typ is None:
+            typ = _interned_types.setdefault(key, Type(name=name, parameters=parameters))
+
+        return typ
+
+    def __reduce__(self):
+        if self.data is None:
+            return (Type.get, (self.name, self.parameters))
+
+        return (Type, (self.name, self.parameters, self.data))
 
     def __str__(self):
         if len(self.parameters) == 0:
@@ -15,104 +35,116 @@ class Type:
         
         return f"{self.name}<{', '.join(str(param) for param in self.parameters)}>"
 
-@dataclass
+_interned_types: dict[tuple[str, tuple], Type] = {}
+
+@dataclass(slots=True)
 class NumberValue:
     value: float
 
-@dataclass
+@dataclass(slots=True)
 class StringValue:
     value: str
 
-@dataclass
+@dataclass(slots=True)
 class StyledTextValue:
     value: str
 
-@dataclass
+@dataclass(slots=True)
 class Variable:
     name: str
     location: TokenLocation
     scope: str = None
+    symbol: object = field(default=None, repr=False, compare=False) # set by the Resolver
 
-@dataclass
+@dataclass(slots=True)
 class VectorValue:
     x: float
     y: float
     z: float
 
-@dataclass
+@dataclass(slots=True)
 class ListValue:
     values: List[object]
 
-@dataclass
+@dataclass(slots=True)
 class DictValue:
     values: List[tuple[str, object]]
 
-@dataclass
+@dataclass(slots=True)
 class TopDefinitions:
     source: str
     definitions: List[object]
 
-@dataclass
+@dataclass(slots=True)
 class FuncDefinition:
     name: str
     args: List[tuple[str, Type, bool, bool, bool, str]] # name, type, optional, pural, is out, desc
     # return_type: Type
     body: List[object]
+    symbol: object = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class VarDefintion:
     name: str
     type: Type
     scope: str = "line"
     value: object = None
+    location: TokenLocation = None
+    symbol: object = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class AssignVar:
     name: str
     value: object 
+    location: TokenLocation = None
+    symbol: object = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class CallFunction:
     name: str
     args: List[object]
+    location: TokenLocation = None
+    symbol: object = field(default=None, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class CodeBlockStatement:
     action: str
     category: str
     target: str = None
+    location: TokenLocation = None
 
-@dataclass
+@dataclass(slots=True)
 class CallCB:
     codeblock: CodeBlockStatement
     args: List[object]
+    location: TokenLocation = None
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOperation:
     left: object
     right: object
     operation: Token
 
-@dataclass
+@dataclass(slots=True)
 class Cast:
     value: object
     type: Type
 
-@dataclass
+@dataclass(slots=True)
 class Dictionary:
     data: List[tuple[str, object]] # (key, value) pairs
 
-@dataclass
+@dataclass(slots=True)
 class ListValue:
     data: List[object] # value list
 
-@dataclass
+@dataclass(slots=True)
 class Index:
     obj: object
     index: object
     location: TokenLocation
 
-@dataclass
+@dataclass(slots=True)
 class SetIndex:
     obj: object
     index: object
@@ -1,10 +1,75 @@
+import copy
+from dataclasses import fields, is_dataclass
 from . import nodes
-from .scanner import Token, TokenLocation, TokenType
-from typing import List
+from .scanner import Token, TokenBuffer, TokenLocation, TokenType
+from typing import Iterator, List
+
+
+class TokenStream:
+    """Indexable window over a token iterator.
+
+    Tokens are pulled from the iterator when first indexed and kept in a small
+    ring buffer, so only the last few tokens are alive at any time. The parser
+    only ever looks at the current token and the one before it (`prev()` and
+    the rewind in casts), which easily fits.
+    """
+    size = 8 # must be a power of two
+
+    def __init__(self, tokens: Iterator[Token]) -> None:
+        self.iterator = iter(tokens)
+        self.ring: List[Token] = [None] * self.size
+        self.filled = 0 # number of tokens pulled so far
+        self.kinds = _TokenStreamKinds(self)
+
+    def __getitem__(self, idx: int) -> Token:
+        while idx >= self.filled:
+            token = next(self.iterator, None)
+
+            # past the end, keep handing out the EOF token
+            if token is None:
+                token = self.ring[(self.filled - 1) & (self.size - 1)]
+
+            self.ring[self.filled & (self.size - 1)] = token
+            self.filled += 1
+
+        if idx < self.filled - self.size:
+            raise IndexError(f"Token #{idx} has already been released from the stream")
+
+        return self.ring[idx & (self.size - 1)]
+
+
+class _TokenStreamKinds:
+    # lets the parser read token types of a stream the same way as a TokenBuffer's kinds
+    __slots__ = ("stream",)
+
+    def __init__(self, stream: TokenStream) -> None:
+        self.stream = stream
+
+    def __getitem__(self, idx: int) -> TokenType:
+        return self.stream[idx].type
+
+
+class _Frame:
+    # a construct of the expression being parsed that is still open
+    TOP, GROUP, CAST, ASSIGN, INDEX, CALL, LIST, DICT = range(8)
+
+    __slots__ = ("kind", "data", "operands", "operators", "postfix", "closed")
+
+    def __init__(self, kind: int, data: object = None) -> None:
+        self.kind = kind
+        self.data = data # whatever the construct needs once its expression is done
+        self.reset()
+
+    def reset(self):
+        self.operands = []
+        self.operators = [] # (token, precedence data)
+        self.postfix = True # whether the top operand can still be indexed or called
+        self.closed = False # whether the expression can't be extended any further
 
 
 class Parser:
-    tokens: List[Token]
+    tokens: List[Token] | TokenBuffer | TokenStream
+    kinds: List[TokenType] # token types only, a TokenBuffer's are read straight from its array
     current: int
     constants: dict[str, object]
     precedence: dict[TokenType, int] = {
@@ -15,18 +80,34 @@ class Parser:
         TokenType.ARROW_UP: (30, False), # False = right associativity
     }
 
-    def parse(self, tokens: List[Token], source: str) -> nodes.TopDefinitions:
-        self.tokens = tokens
+    def parse(self, tokens: List[Token] | TokenBuffer | Iterator[Token], source: str) -> nodes.TopDefinitions:
+        return nodes.TopDefinitions(source=source, definitions=list(self.parse_iter(tokens)))
+
+    def parse_iter(self, tokens: List[Token] | TokenBuffer | Iterator[Token]) -> Iterator[object]:
+        """Yields the top level definitions one by one, as they're parsed.
+
+        Nothing is kept of a definition once it's been yielded (besides the
+        expressions of constants), so with a token iterator memory use only
+        depends on the size of the largest definition.
+        """
+        if isinstance(tokens, TokenBuffer):
+            self.tokens = tokens
+            self.kinds = tokens.kinds
+        elif isinstance(tokens, (list, tuple)):
+            self.tokens = tokens
+            self.kinds = [token.type for token in tokens]
+        else:
+            # any other iterable (like Scanner.tokens()) is parsed while it's being scanned
+            self.tokens = TokenStream(tokens)
+            self.kinds = self.tokens.kinds
+
         self.current = 0
         self.constants = {}
-        defs = []
 
         while self.available():
             vdef = self.parse_def()
             if vdef:
-                defs.append(vdef)
-
-        return nodes.TopDefinitions(source=source, definitions=defs)
+                yield vdef
 
 
     def parse_def(self):
@@ -58,7 +139,7 @@ class Parser:
         self.consume(TokenType.OPEN_PAREN, "Expected '('")
         
         args = []
-        while self.peek().type != TokenType.CLOSE_PAREN:
+        while self.peek_type() != TokenType.CLOSE_PAREN:
             out = self.match(TokenType.OUT)
             arg_name = self.consume(TokenType.IDENTIFIER, "Expected function argument name")
             self.consume(TokenType.COLON, "Expected function argument type")
@@ -69,7 +150,7 @@ class Parser:
 
             desc = self.prev() if self.match(TokenType.STRING) else None
 
-            if self.peek().type != TokenType.CLOSE_PAREN:
+            if self.peek_type() != TokenType.CLOSE_PAREN:
                 self.consume(TokenType.COMMA, "Expected ',' or ')' after function argument")
 
             args.append((arg_name.value, arg_type, optional, pural, out, None if desc == None else desc.value[1:-1]))
@@ -83,7 +164,7 @@ class Parser:
         self.consume(TokenType.OPEN_BRACE, "Expected '{' to start function body")
 
         body = []
-        while self.peek().type != TokenType.CLOSE_BRACE:
+        while self.peek_type() != TokenType.CLOSE_BRACE:
             loc = self.peek().location
             stmt = self.parse_statement()
             stmt.location = loc
@@ -112,191 +193,332 @@ class Parser:
         self.consume(TokenType.SEMICOLON, "Expected ';' after statement")
         return expr
         
+    # EXPRESSIONS
+    #
+    # Expressions are parsed without recursion: an explicit stack of frames, one
+    # per construct that is still open (parentheses, call arguments, index,
+    # list and dict literals, casts and the right side of assignments). Each
+    # frame runs precedence climbing over Parser.precedence with its own operand
+    # and operator stacks. Tokens are dispatched through the tables at the end
+    # of this section.
+
     def parse_expr(self):
-        return self.parse_assign()
-    
-    def parse_assign(self):
-        left = self.parse_bin_op()
+        frames = [_Frame(_Frame.TOP)]
+        expect_operand = True
 
-        if self.match(TokenType.EQUALS):
-            eq = self.prev()
-            if type(left) is nodes.Variable:
-                value = self.parse_expr()
-                left = nodes.AssignVar(name=left.name, value=value)
+        while True:
+            frame = frames[-1]
+            token_type = self.peek_type()
+
+            if expect_operand:
+                prefix = self.prefix_parsers.get(token_type)
+                if not prefix:
+                    self.error("Expected expression")
+
+                operand = prefix(self, frames, None)
+
+                # None means a frame was opened and its expression comes first
+                if operand is not None:
+                    frame.operands.append(operand)
+                    frame.postfix = True
+                    expect_operand = False
+
+                continue
+
+            if not frame.closed:
+                postfix = self.postfix_parsers.get(token_type)
+                if postfix and frame.postfix:
+                    expect_operand = postfix(self, frames)
+                    continue
+
+                prec_data = self.precedence.get(token_type)
+                if prec_data:
+                    operator = self.advance()
+                    self._reduce(frame, prec_data)
+                    frame.operators.append((operator, prec_data))
+                    expect_operand = True
+                    continue
+
+                if token_type == TokenType.EQUALS:
+                    expect_operand = self._parse_assign(frames)
+                    continue
+
+            # nothing else can extend this frame's expression
+            value = self._reduce(frame)
+
+            if frame.kind == _Frame.TOP:
+                return value
 
-            elif type(left) is nodes.Index:
-                value = self.parse_expr()
-                left = nodes.SetIndex(obj=left.obj, index=left.index, value=value, location=eq.location)
+            frames.pop()
+            operand = self.frame_completions[frame.kind](self, frame, value)
 
-        return left
-    
-    def parse_bin_op(self, prec_level: int = 0):
-        left = self.parse_call()
+            # None means the frame was reopened for its next element
+            if operand is None:
+                frames.append(frame)
+                expect_operand = True
+            else:
+                parent = frames[-1]
+                parent.operands.append(operand)
+                # nothing can follow a call, anything else can be indexed or called
+                parent.postfix = frame.kind != _Frame.CALL
+                parent.closed = frame.kind == _Frame.ASSIGN
+                expect_operand = False
+
+    def _reduce(self, frame, prec_data: tuple = None):
+        # folds operators binding at least as tight as `prec_data` (all of them
+        # by default) into BinaryOperations, returns the top operand
+        operators = frame.operators
+        operands = frame.operands
+
+        while operators:
+            if prec_data is not None:
+                top_prec = operators[-1][1][0]
+                (prec, left_assoc) = prec_data
+                if top_prec < prec or (top_prec == prec and not left_assoc):
+                    break
 
-        while True:
-            if not self.available(): break
-            token = self.peek()
-            if token.type not in self.precedence: break # not an operator
-            prec_data = self.precedence[token.type]
-            if prec_data[0] < prec_level: break # precedence is too low, skip
+            operator = operators.pop()[0]
+            right = operands.pop()
+            operands[-1] = nodes.BinaryOperation(left=operands[-1], right=right, operation=operator)
 
-            self.advance() # consume operator token
+        return operands[-1]
 
-            right = self.parse_bin_op(prec_level + 1 if prec_data[1] else prec_level)
-            left = nodes.BinaryOperation(left=left, right=right, operation=token)
+    def _parse_assign(self, frames) -> bool:
+        frame = frames[-1]
+        left = self._reduce(frame)
+        eq = self.advance()
 
-        return left
-    
-    def parse_call(self):
-        left = self.parse_index()
+        if type(left) is nodes.Variable or type(left) is nodes.Index:
+            frame.operands.pop()
+            frames.append(_Frame(_Frame.ASSIGN, (left, eq)))
+            return True
 
-        if self.match(TokenType.OPEN_PAREN):
-            if isinstance(left, nodes.Variable):
-                args = []
+        # nothing to assign to, the '=' is dropped and the expression ends here
+        frame.closed = True
+        return False
 
-                while self.peek().type != TokenType.CLOSE_PAREN:
-                    args.append(self.parse_expr())
+    # prefix parsers: (self, frames, target) -> operand node, or None after opening a frame
 
-                    if self.peek().type != TokenType.CLOSE_PAREN:
-                        self.consume(TokenType.COMMA, "Expected ',' after argument")
+    def _parse_target(self, frames, target):
+        target = self.advance().value[1:]
+        prefix = self.prefix_parsers.get(self.peek_type())
 
-                self.consume(TokenType.CLOSE_PAREN, "Expected ')' after function call arguments")
-                left = nodes.CallFunction(name=left.name, args=args)
+        if not prefix or prefix is Parser._parse_target:
+            self.error("Expected expression")
 
-            elif isinstance(left, nodes.CodeBlockStatement):
-                args = []
+        return prefix(self, frames, target)
 
-                while self.peek().type != TokenType.CLOSE_PAREN:
-                    args.append(self.parse_expr())
+    def _parse_codeblock(self, frames, target):
+        self.advance()
+        action = self.consume(TokenType.STRING, "Expected codeblock action (as string)")
+        self.consume(TokenType.LOWER, "Expected '<'")
+        category = self.consume(TokenType.STRING, "Expected codeblock category as string")
+        self.consume(TokenType.GREATER, "Expected '>'")
+        return nodes.CodeBlockStatement(action=action.value[1:-1], category=category.value[1:-1], target=target)
 
-                    if self.peek().type != TokenType.CLOSE_PAREN:
-                        self.consume(TokenType.COMMA, "Expected ',' after argument")
+    def _parse_name(self, frames, target):
+        tok = self.advance()
+        name = tok.value[2:-1] if tok.type == TokenType.STRING_VAR else tok.value
 
-                self.consume(TokenType.CLOSE_PAREN, "Expected ')' after call arguments")
-                left = nodes.CallCB(codeblock=left, args=args)
+        # CONST VALUE
+        if name in self.constants:
+            value = self.constants[name]
 
+            if isinstance(value, nodes.CodeBlockStatement):
+                return nodes.CodeBlockStatement(action=value.action, category=value.category, target=target if target != None else value.target)
 
-        return left
-    
-    def parse_index(self):
-        left = self.parse_primary()
+            # every use gets its own nodes, names in it are resolved where it's used
+            return _clone(value)
 
-        while True:
-            if self.match(TokenType.OPEN_SQUARE):
-                loc = self.prev().location
-                idx = self.parse_expr()
-                self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after index")
-                left = nodes.Index(obj=left, index=idx, location=loc)
-            elif self.match(TokenType.DOT):
-                loc = self.prev().location
-                idx = self.consume(TokenType.IDENTIFIER, "Expected index name after '.'")
-                left = nodes.Index(obj=left, index=nodes.StringValue(value=idx.value), location=loc)
-            else:
-                break
+        return nodes.Variable(name=name, location=tok.location)
 
-        return left
+    def _parse_number(self, frames, target):
+        return nodes.NumberValue(value=float(self.advance().value))
 
-    def parse_primary(self):
-        target = None
-        if self.match(TokenType.TARGET):
-            target = self.prev().value[1:]
+    def _parse_string(self, frames, target):
+        return nodes.StringValue(value=self.advance().value[1:-1])
 
-        if self.match(TokenType.CODEBLOCK):
-            action = self.consume(TokenType.STRING, "Expected codeblock action (as string)")
-            self.consume(TokenType.LOWER, "Expected '<'")
-            category = self.consume(TokenType.STRING, "Expected codeblock category as string")
-            self.consume(TokenType.GREATER, "Expected '>'")
-            return nodes.CodeBlockStatement(action=action.value[1:-1], category=category.value[1:-1], target=target)
+    def _parse_styled_text(self, frames, target):
+        return nodes.StyledTextValue(value=self.advance().value[1:-1])
 
-        if self.match(TokenType.IDENTIFIER):
-            # CONST VALUE
-            name = self.prev().value
-            if name in self.constants:
-                value = self.constants[name]
+    def _parse_vector(self, frames, target):
+        self.advance()
+        x_component = self.consume(TokenType.NUMBER, "Expected x component of vector")
+        self.consume(TokenType.COMMA, "Expected ','")
+        y_component = self.consume(TokenType.NUMBER, "Expected y component of vector")
+        self.consume(TokenType.COMMA, "Expected ','")
+        z_component = self.consume(TokenType.NUMBER, "Expected z component of vector")
+        self.consume(TokenType.GREATER, "Expected '>' after vector components")
 
-                if isinstance(value, nodes.CodeBlockStatement):
-                    return nodes.CodeBlockStatement(action=value.action, category=value.category, target=target if target != None else value.target)
+        return nodes.VectorValue(x=float(x_component.value), y=float(y_component.value), z=float(z_component.value))
 
-                return value
+    def _parse_group(self, frames, target):
+        self.advance()
 
-            return nodes.Variable(name=name, location=self.prev().location)
-        
-        if self.match(TokenType.STRING_VAR):
-            # CONST VALUE
-            name = self.prev().value[2:-1]
-            if name in self.constants:
-                value = self.constants[name]
+        # cast, applies to the whole expression after it
+        if self.peek_type() == TokenType.TYPE:
+            cast_type = self.parse_type("Expected type in cast")
+            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after cast type")
+            frames.append(_Frame(_Frame.CAST, cast_type))
+            return None
 
-                if isinstance(value, nodes.CodeBlockStatement):
-                    return nodes.CodeBlockStatement(action=value.action, category=value.category, target=target if target != None else value.target)
+        frames.append(_Frame(_Frame.GROUP))
+        return None
 
-                return value
+    def _parse_dictionary(self, frames, target):
+        self.advance()
 
-            return nodes.Variable(name=name, location=self.prev().location)
+        if self.peek_type() == TokenType.CLOSE_BRACE:
+            self.advance()
+            return nodes.Dictionary(data=[])
 
-        if self.match(TokenType.NUMBER):
-            return nodes.NumberValue(value=float(self.prev().value))
-        
-        if self.match(TokenType.STRING):
-            return nodes.StringValue(value=self.prev().value[1:-1])
-        
-        if self.match(TokenType.STYLED_TEXT):
-            return nodes.StyledTextValue(value=self.prev().value[1:-1])
-        
-        # vector
-        if self.match(TokenType.LOWER):
-            x_component = self.consume(TokenType.NUMBER, "Expected x component of vector")
-            self.consume(TokenType.COMMA, "Expected ','")
-            y_component = self.consume(TokenType.NUMBER, "Expected y component of vector")
-            self.consume(TokenType.COMMA, "Expected ','")
-            z_component = self.consume(TokenType.NUMBER, "Expected z component of vector")
-            self.consume(TokenType.GREATER, "Expected '>' after vector components")
-
-            return nodes.VectorValue(x=float(x_component.value), y=float(y_component.value), z=float(z_component.value))
-        
-        if self.match(TokenType.OPEN_PAREN):
-            if self.match(TokenType.TYPE):
-                self.current -= 1
-                cast_type = self.parse_type("Expected type in cast")
-                self.consume(TokenType.CLOSE_PAREN, "Expected ')' after cast type")
-                expr = self.parse_expr()
-                return nodes.Cast(value=expr, type=cast_type)
-
-            expr = self.parse_expr()
-            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after expression")
-            return expr
-        
-        if self.match(TokenType.OPEN_BRACE):
-            data = []
+        frames.append(_Frame(_Frame.DICT, ([], self._parse_dict_key())))
+        return None
 
-            if self.peek().type != TokenType.CLOSE_BRACE:
-                while True:
-                    key = self.consume(TokenType.STRING, "Expected dictionary key (string)")
-                    self.consume(TokenType.COLON, "Expected ':' after dictionary key")
-                    value = self.parse_expr()
-                    data.append((key.value[1:-1], value))
-                    if self.peek().type == TokenType.CLOSE_BRACE: break
-                    self.consume(TokenType.COMMA, "Expected ',' after dictionary entry")
+    def _parse_dict_key(self) -> str:
+        key = self.consume(TokenType.STRING, "Expected dictionary key (string)")
+        self.consume(TokenType.COLON, "Expected ':' after dictionary key")
+        return key.value[1:-1]
 
+    def _parse_list(self, frames, target):
+        self.advance()
 
-            self.consume(TokenType.CLOSE_BRACE, "Expected '}' after dictionary")
-            return nodes.Dictionary(data=data)
+        if self.peek_type() == TokenType.CLOSE_SQUARE:
+            self.advance()
+            return nodes.ListValue(data=[])
+
+        frames.append(_Frame(_Frame.LIST, []))
+        return None
+
+    # postfix parsers: (self, frames) -> whether an operand is expected next
+
+    def _parse_index(self, frames) -> bool:
+        frame = frames[-1]
+        loc = self.advance().location
+        frames.append(_Frame(_Frame.INDEX, (frame.operands.pop(), loc)))
+        return True
+
+    def _parse_attribute(self, frames) -> bool:
+        frame = frames[-1]
+        loc = self.advance().location
+        idx = self.consume(TokenType.IDENTIFIER, "Expected index name after '.'")
+        frame.operands[-1] = nodes.Index(obj=frame.operands[-1], index=nodes.StringValue(value=idx.value), location=loc)
+        return False
+
+    def _parse_call(self, frames) -> bool:
+        frame = frames[-1]
+        callee = frame.operands[-1]
+
+        if not isinstance(callee, (nodes.Variable, nodes.CodeBlockStatement)):
+            self.error("Only functions and codeblocks can be called")
+
+        self.advance()
+
+        if self.peek_type() == TokenType.CLOSE_PAREN:
+            frame.operands[-1] = self._finish_call(callee, [])
+            frame.postfix = False
+            return False
+
+        frames.append(_Frame(_Frame.CALL, (frame.operands.pop(), [])))
+        return True
 
-        if self.match(TokenType.OPEN_SQUARE):
-            data = []
+    def _finish_call(self, callee, args: list):
+        if isinstance(callee, nodes.Variable):
+            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after function call arguments")
+            return nodes.CallFunction(name=callee.name, args=args)
 
-            if self.peek().type != TokenType.CLOSE_SQUARE:
-                while True:
-                    value = self.parse_expr()
-                    data.append(value)
-                    if self.peek().type == TokenType.CLOSE_SQUARE: break
-                    self.consume(TokenType.COMMA, "Expected ',' after list value")
+        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after call arguments")
+        return nodes.CallCB(codeblock=callee, args=args)
+
+    # frame completions: (self, frame, value) -> operand for the parent frame,
+    # or None when the frame has to be reopened for its next element
+
+    def _complete_group(self, frame, value):
+        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after expression")
+        return value
+
+    def _complete_cast(self, frame, value):
+        return nodes.Cast(value=value, type=frame.data)
+
+    def _complete_assign(self, frame, value):
+        (left, eq) = frame.data
+
+        if type(left) is nodes.Variable:
+            return nodes.AssignVar(name=left.name, value=value)
+
+        return nodes.SetIndex(obj=left.obj, index=left.index, value=value, location=eq.location)
+
+    def _complete_index(self, frame, value):
+        (obj, loc) = frame.data
+        self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after index")
+        return nodes.Index(obj=obj, index=value, location=loc)
+
+    def _complete_call(self, frame, value):
+        (callee, args) = frame.data
+        args.append(value)
+
+        if self.peek_type() != TokenType.CLOSE_PAREN:
+            self.consume(TokenType.COMMA, "Expected ',' after argument")
+
+        if self.peek_type() != TokenType.CLOSE_PAREN:
+            frame.reset()
+            return None
 
+        return self._finish_call(callee, args)
 
-            self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after list")
-            return nodes.ListValue(data=data)
+    def _complete_list(self, frame, value):
+        frame.data.append(value)
 
-        self.error("Expected expression")
+        if self.peek_type() == TokenType.CLOSE_SQUARE:
+            self.advance()
+            return nodes.ListValue(data=frame.data)
+
+        self.consume(TokenType.COMMA, "Expected ',' after list value")
+        frame.reset()
+        return None
+
+    def _complete_dictionary(self, frame, value):
+        (data, key) = frame.data
+        data.append((key, value))
+
+        if self.peek_type() == TokenType.CLOSE_BRACE:
+            self.advance()
+            return nodes.Dictionary(data=data)
+
+        self.consume(TokenType.COMMA, "Expected ',' after dictionary entry")
+        frame.data = (data, self._parse_dict_key())
+        frame.reset()
+        return None
+
+    prefix_parsers = {
+        TokenType.TARGET: _parse_target,
+        TokenType.CODEBLOCK: _parse_codeblock,
+        TokenType.IDENTIFIER: _parse_name,
+        TokenType.STRING_VAR: _parse_name,
+        TokenType.NUMBER: _parse_number,
+        TokenType.STRING: _parse_string,
+        TokenType.STYLED_TEXT: _parse_styled_text,
+        TokenType.LOWER: _parse_vector,
+        TokenType.OPEN_PAREN: _parse_group,
+        TokenType.OPEN_BRACE: _parse_dictionary,
+        TokenType.OPEN_SQUARE: _parse_list,
+    }
+
+    postfix_parsers = {
+        TokenType.OPEN_SQUARE: _parse_index,
+        TokenType.DOT: _parse_attribute,
+        TokenType.OPEN_PAREN: _parse_call,
+    }
+
+    frame_completions = {
+        _Frame.GROUP: _complete_group,
+        _Frame.CAST: _complete_cast,
+        _Frame.ASSIGN: _complete_assign,
+        _Frame.INDEX: _complete_index,
+        _Frame.CALL: _complete_call,
+        _Frame.LIST: _complete_list,
+        _Frame.DICT: _complete_dictionary,
+    }
 
     def parse_type(self, msg: str = "Expected type"):
         args = []
@@ -306,18 +528,18 @@ class Parser:
             while True:
                 args.append(self.parse_type())
 
-                if self.peek().type != TokenType.GREATER:
+                if self.peek_type() != TokenType.GREATER:
                     self.consume(TokenType.COMMA, "Expected ',' after type in type template")
                 else:
                     break
 
             self.consume(TokenType.GREATER, "Expected '>' to close type template")
 
-        return nodes.Type(name=typ.value, parameters=args)
+        return nodes.Type.get(typ.value, args)
 
     # helper funcs
     def consume(self, type: TokenType, err: str) -> Token:
-        if self.peek().type != type:
+        if self.peek_type() != type:
             raise ParserError(err, self.peek().location)
         
         return self.advance()
@@ -325,12 +547,16 @@ class Parser:
     def peek(self, ahead: int = 0) -> Token:
         return self.tokens[self.current + ahead]
 
+    def peek_type(self, ahead: int = 0) -> TokenType:
+        return self.kinds[self.current + ahead]
+
     def available(self) -> bool:
-        return self.peek().type != TokenType.EOF
+        return self.peek_type() != TokenType.EOF
 
     def match(self, *types: TokenType) -> bool:
+        current_type = self.peek_type()
         for type in types:
-            if self.peek().type == type:
+            if current_type == type:
                 self.current += 1
                 return True
         
@@ -350,13 +576,51 @@ class Parser:
         
     
 
+def _clone(value):
+    """A copy of a constant's expression with nodes, lists and tuples of its
+    own. Tokens, types and locations never change and are shared. Walked
+    with a stack, constants can nest deeper than Python's recursion limit."""
+    root = [value]
+    # (container, index or field name, turn the copied list back into a tuple)
+    stack = [(root, 0, False)]
+
+    while stack:
+        (parent, key, to_tuple) = stack.pop()
+        item = parent[key] if type(parent) is list else getattr(parent, key)
+
+        if to_tuple:
+            item = tuple(item)
+
+        elif type(item) in (list, tuple):
+            # the tuple is made once its items are copied, they're popped first
+            if type(item) is tuple:
+                stack.append((parent, key, True))
+
+            item = list(item)
+            stack.extend((item, i, False) for i in range(len(item)))
+
+        elif is_dataclass(item) and type(item) not in (nodes.Type, Token):
+            item = copy.copy(item)
+            stack.extend((item, f.name, False) for f in fields(item))
+
+        else:
+            continue
+
+        if type(parent) is list:
+            parent[key] = item
+        else:
+            setattr(parent, key, item)
+
+    return root[0]
+
+
 class ParserError(Exception):
     def __init__(self, msg, location: TokenLocation) -> None:
         self.msg = msg
         self.location = location
 
     def __repr__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
 
     def __str__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
\ No newline at end of file
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
\ No newline at end of file
@@ -0,0 +1,413 @@
+"""Optimization passes over ir.Functions, registered with ir.register_pass and
+run in the order they're defined here. Level 1 runs constant folding (with
+copy propagation) and dead-store removal, level 2 adds algebraic
+simplification, which flattens chains across blocks, and the reuse of
+temporaries."""
+
+import heapq, math, operator, re
+from collections import Counter
+from . import diamondfire as df
+from .ir import Function, Instruction, ASSIGNING_ACTIONS, MODIFYING_ACTIONS, assigned, register_pass
+
+
+# arithmetic set_var actions, applied left to right over all their operands
+_ARITHMETIC = {
+    "+": operator.add,
+    "-": operator.sub,
+    "x": operator.mul,
+    "/": operator.truediv,
+    "Exponent": operator.pow
+}
+
+def _exact(value) -> bool:
+    # DF numbers have 3 decimals, anything finer is rounded by DF after every
+    # step, so only values that are exact at that precision are computed here
+    return not isinstance(value, complex) and math.isfinite(value) and round(value, 3) == value
+
+def _fold(action: str, operands: list[df.NumberItem]) -> df.NumberItem:
+    """The NumberItem `action` computes from constant operands, or None if it
+    has to be left to DiamondFire."""
+    # Exponent has an optional exponent and ignores anything past it
+    if len(operands) < 2 or (action == "Exponent" and len(operands) != 2):
+        return None
+
+    values = [float(operand.value) for operand in operands]
+    if not all(_exact(value) for value in values):
+        return None
+
+    op = _ARITHMETIC[action]
+    value = values[0]
+
+    for operand in values[1:]:
+        try:
+            value = op(value, operand)
+        except (ZeroDivisionError, OverflowError):
+            return None
+
+        if not _exact(value):
+            return None
+
+    return df.NumberItem.get(value)
+
+
+# blocks that run other code, which sees the same line variables
+_CALLS = frozenset(("call_func", "start_process"))
+
+def _has_placeholder(item: df.Item) -> bool:
+    # %var(...) and the like are only filled in at runtime, and can name any variable
+    return type(item) in (df.VariableItem, df.StringItem, df.StyledTextItem) and "%" in (item.name if type(item) is df.VariableItem else item.value)
+
+_PLACEHOLDER_CALL = re.compile(r"%(\w+)\((?:([^()%]*)\))?")
+
+def _placeholder_reads(item: df.Item) -> set[df.VariableItem]:
+    """Line variables text reads through %var(name), None if it could read
+    any variable. %default and the like don't read variables at all."""
+    if type(item) not in (df.StringItem, df.StyledTextItem):
+        return set() if not _has_placeholder(item) else None
+
+    reads = set()
+    for match in _PLACEHOLDER_CALL.finditer(item.value):
+        # %math(...), %index(...) and names built from placeholders themselves
+        if match[1] != "var" or match[2] is None:
+            return None
+
+        reads.add(df.VariableItem.get(match[2], 'line'))
+
+    return reads
+
+def _propagatable(item: df.Item) -> bool:
+    """Whether a read of a copy of `item` can read `item` itself instead."""
+    if type(item) is df.VariableItem:
+        return item.scope == 'line' and not _has_placeholder(item)
+
+    return type(item) in (df.NumberItem, df.StringItem, df.StyledTextItem, df.VectorItem) and not _has_placeholder(item)
+
+def _forget(known: dict[df.VariableItem, df.Item], item: df.Item):
+    """Drops what's known about a variable that's changed."""
+    if _has_placeholder(item):
+        known.clear()
+
+    elif type(item) is df.VariableItem:
+        known.pop(item, None)
+
+        for (var, value) in list(known.items()):
+            if value is item:
+                del known[var]
+
+
+@register_pass("constant-folding", level=1)
+def fold_constants(function: Function):
+    """Folds arithmetic on constants into a plain `=`, and propagates copies:
+    where a set_var reads a line variable that's known to hold a constant or
+    the same value as another line variable, it reads that instead."""
+    known: dict[df.VariableItem, df.Item] = {}
+
+    for inst in function.body:
+        if inst.type in _CALLS:
+            known.clear()
+            continue
+
+        # Other blocks can only change the variables given to them. They're
+        # never substituted, an argument may have to be a variable.
+        if inst.type != 'set_var' or (inst.action not in ASSIGNING_ACTIONS and inst.action not in MODIFYING_ACTIONS):
+            for arg in inst.args:
+                _forget(known, arg)
+
+            continue
+
+        dest = inst.args[0]
+        operands = [known.get(arg, arg) for arg in inst.args[1:]]
+
+        if inst.action in _ARITHMETIC and all(type(operand) is df.NumberItem for operand in operands):
+            value = _fold(inst.action, operands)
+            if value is not None:
+                inst.action = "="
+                operands = [value]
+
+        inst.args = [dest] + operands
+        _forget(known, dest)
+
+        if inst.action == "=" and operands[0] is not dest and _propagatable(dest) and _propagatable(operands[0]):
+            known[dest] = operands[0]
+
+
+# operands of these can be regrouped and reordered, with their identity
+_ASSOCIATIVE = {"+": 0.0, "x": 1.0}
+# all operands past the first are subtracted, their sum can be subtracted instead
+_SUBTRACTIVE = {"-": "+"}
+# none of these have tags, only the result variable shares the chest
+_MAX_OPERANDS = df.CHEST_SLOTS - 1
+
+def _is_number(item: df.Item, value: float = None) -> bool:
+    return type(item) is df.NumberItem and (value is None or float(item.value) == value)
+
+def _reads(inst: Instruction) -> list[df.Item]:
+    """Args `inst` may read."""
+    return inst.args if assigned(inst) is None else inst.args[1:]
+
+def _read_once(body: list[Instruction], index: int, item: df.VariableItem, reads: Counter) -> bool:
+    """Whether body[index] is the only read of the value `item` holds there.
+    `reads` counts the reads of every temporary in body."""
+    dest = assigned(body[index])
+    if body[index].args[0 if dest is None else 1:].count(item) != 1:
+        return False
+
+    # read nowhere else at all, long chains would otherwise be scanned to
+    # the end once per link
+    if dest is item or reads[item] == 1:
+        return True
+
+    for inst in body[index + 1:]:
+        dest = assigned(inst)
+        if item in inst.args[0 if dest is None else 1:]:
+            return False
+
+        if dest is item:
+            return True
+
+    return True
+
+def _regroupable(action: str, operands: list[df.Item]) -> bool:
+    """Whether a block computing `operands` can be merged into the one using
+    its result without DF's rounding to 3 decimals giving another result."""
+    numbers = [operand for operand in operands if _is_number(operand)]
+
+    if action == "x":
+        # a product of variables or fractions has more decimals than DF keeps
+        return len(operands) - len(numbers) <= 1 and all(float(n.value).is_integer() for n in numbers)
+
+    return all(_exact(float(n.value)) for n in numbers)
+
+def _written(inst: Instruction) -> list[df.VariableItem]:
+    """Variables `inst` may change."""
+    dest = assigned(inst)
+    return [dest] if dest is not None else [arg for arg in inst.args if type(arg) is df.VariableItem]
+
+def _definition(body: list[Instruction], index: int, item: df.VariableItem) -> Instruction:
+    """The set_var whose result `item` still holds at body[index], if its
+    operands also still hold the same values there."""
+    for i in range(index - 1, -1, -1):
+        if assigned(body[i]) is item:
+            break
+
+        # a %placeholder name could be any variable
+        if any(var is item or "%" in var.name for var in _written(body[i])):
+            return None
+
+    else:
+        return None
+
+    operands = {arg for arg in body[i].args[1:] if type(arg) is df.VariableItem}
+    if item in operands:
+        return None
+
+    for later in body[i + 1:index]:
+        if any(var in operands or "%" in var.name for var in _written(later)):
+            return None
+
+    return body[i]
+
+def _flatten(function: Function, index: int, operands: list[df.Item], reads: Counter) -> list[df.Item]:
+    """Operands of the chain function.body[index] is the end of, temporaries
+    holding the result of the same action are replaced with that block's
+    operands: (a + b) + (c + d) -> a + b + c + d, (x - 1) - y -> x - 1 - y."""
+    body = function.body
+    action = body[index].action
+    flat = []
+
+    for (i, operand) in enumerate(operands):
+        inner = None
+
+        # x - (y - 1) isn't x - y - 1, only the first operand is regrouped there
+        if operand in function.temporaries and (action in _ASSOCIATIVE or i == 0):
+            inner = _definition(body, index, operand)
+
+        # All operands have to fit in the chest next to the result variable,
+        # the inner block's operands replace this one. A lone operand of - is
+        # left alone, DF doesn't simply copy it.
+        if (inner is not None and inner.type == 'set_var' and inner.action == action
+                and (action in _ASSOCIATIVE or len(inner.args) > 2)
+                and len(flat) + len(inner.args) - 1 + len(operands) - i - 1 <= _MAX_OPERANDS
+                and _regroupable(action, inner.args[1:]) and _read_once(body, index, operand, reads)):
+            flat.extend(inner.args[1:])
+        else:
+            flat.append(operand)
+
+    return flat
+
+def _combine(action: str, numbers: list[df.NumberItem]) -> list[df.NumberItem]:
+    """`numbers` folded into a single operand of `action` where exact."""
+    if len(numbers) < 2:
+        return numbers
+
+    # x*0.5*4 isn't x*2 once DF rounds x*0.5, only whole factors regroup
+    if action == "x" and not all(float(n.value).is_integer() for n in numbers):
+        return numbers
+
+    value = _fold(_SUBTRACTIVE.get(action, action), numbers)
+    return numbers if value is None else [value]
+
+
+@register_pass("algebraic-simplification", level=2)
+def simplify_arithmetic(function: Function):
+    """Flattens arithmetic chains into one block and regroups their
+    constants, removes identities (x + 0, x * 1, x / 1, x ^ 1) and replaces
+    x ^ 2 with x * x."""
+    # kept up to date as blocks are rewritten, see _read_once
+    reads = Counter(arg for inst in function.body for arg in _reads(inst) if arg in function.temporaries)
+
+    for (index, inst) in enumerate(function.body):
+        if inst.type != 'set_var' or inst.action not in _ARITHMETIC:
+            continue
+
+        action = inst.action
+        operands = inst.args[1:]
+        count = len(operands)
+
+        if action in _ASSOCIATIVE or action in _SUBTRACTIVE:
+            operands = _flatten(function, index, operands, reads)
+
+        if action in _ASSOCIATIVE:
+            numbers = _combine(action, [operand for operand in operands if _is_number(operand)])
+            operands = [operand for operand in operands if not _is_number(operand)] + numbers
+            identity = _ASSOCIATIVE[action]
+
+            if len(operands) > 1:
+                operands = [operand for operand in operands if not _is_number(operand, identity)] or [df.NumberItem.get(identity)]
+
+        elif action in ("-", "/"):
+            rest = operands[1:]
+            if action == "-":
+                rest = [operand for operand in rest if not _is_number(operand)] + _combine(action, [operand for operand in rest if _is_number(operand)])
+
+            identity = 0.0 if action == "-" else 1.0
+            operands = operands[:1] + [operand for operand in rest if not _is_number(operand, identity)]
+
+        elif len(operands) == 2:
+            (base, exponent) = operands
+
+            if _is_number(exponent, 0.0):
+                operands = [df.NumberItem.get(1.0)]
+
+            elif _is_number(exponent, 1.0):
+                operands = [base]
+
+            elif _is_number(exponent, 2.0):
+                action = "x"
+                operands = [base, base]
+
+        # a single operand left is just a copy. Blocks written with a single
+        # operand are left alone, DF's - and / use it differently and ^ squares it
+        if len(operands) == 1 and (action in _ASSOCIATIVE or len(operands) < count):
+            action = "="
+
+        reads.subtract(operand for operand in inst.args[1:] if operand in function.temporaries)
+        reads.update(operand for operand in operands if operand in function.temporaries)
+        inst.action = action
+        inst.args = inst.args[:1] + operands
+
+
+# simplifying leaves new copies and constants behind (x * 1, x ^ 0)
+register_pass("copy-propagation", level=2)(fold_constants)
+
+
+@register_pass("dead-stores", level=1)
+def remove_dead_stores(function: Function):
+    """Drops stores nothing can read. Temporaries are only read by this
+    function, so a store to one is dead unless it's read afterwards, like
+    the ones left behind by propagating, folding or flattening their only
+    use. Other line variables are seen by called code and by the caller
+    too, so a store to one is only dead when it's stored again before any
+    block could read it."""
+    # temporaries read afterwards
+    live = set()
+    # own variables stored again afterwards, with nothing that could read them in between
+    overwritten = set()
+    body: list[Instruction] = []
+
+    for inst in reversed(function.body):
+        dest = assigned(inst)
+
+        if dest is not None:
+            if (dest in function.temporaries and dest not in live) or dest in overwritten:
+                continue
+
+            live.discard(dest)
+            if dest not in function.temporaries and _propagatable(dest):
+                overwritten.add(dest)
+
+        reads = {arg for arg in (inst.args if dest is None else inst.args[1:]) if type(arg) is df.VariableItem}
+
+        # called code, and placeholders naming variables at runtime, may read any of them
+        if inst.type in _CALLS:
+            overwritten.clear()
+
+        for arg in inst.args:
+            placeholder_reads = _placeholder_reads(arg)
+            if placeholder_reads is None:
+                overwritten.clear()
+            else:
+                reads |= placeholder_reads
+
+        live |= reads
+        overwritten -= reads
+        body.append(inst)
+
+    body.reverse()
+    function.body[:] = body
+
+
+@register_pass("temporary-allocation", level=2)
+def allocate_temporaries(function: Function):
+    """Maps the generator's temporaries onto as few line variables as
+    possible. Every temporary gets a variable from its first to its last
+    use, variables are reused once the temporary holding them is done.
+    Blocks read their operands before they set their result, so a result
+    can go in the variable of an operand read there for the last time."""
+    last_use: dict[df.VariableItem, int] = {}
+    for (index, inst) in enumerate(function.body):
+        for arg in inst.args:
+            if arg in function.temporaries:
+                last_use[arg] = index
+
+    allocated: dict[df.VariableItem, int] = {}
+    # numbers of the variables not holding a temporary, lowest reused first
+    free: list[int] = []
+    count = 0
+
+    def allocate(temps: list[df.VariableItem]):
+        nonlocal count
+
+        for temp in temps:
+            if temp not in allocated:
+                if free:
+                    allocated[temp] = heapq.heappop(free)
+                else:
+                    allocated[temp] = count
+                    count += 1
+
+    def release(temps: list[df.VariableItem], index: int):
+        for temp in temps:
+            if last_use.get(temp) == index:
+                del last_use[temp]
+                heapq.heappush(free, allocated[temp])
+
+    for (index, inst) in enumerate(function.body):
+        temps = [arg for arg in inst.args if arg in function.temporaries]
+
+        if assigned(inst) is not None:
+            operands = [arg for arg in inst.args[1:] if arg in function.temporaries]
+            allocate(operands)
+            release(operands, index)
+
+        allocate(temps)
+        release(temps, index)
+
+    variables = [df.VariableItem.get(f"__tmp{i}", 'line') for i in range(count)]
+
+    for inst in function.body:
+        inst.args = [variables[allocated[arg]] if arg in allocated else arg for arg in inst.args]
+
+    # copies between temporaries that ended up in the same variable
+    function.body[:] = [inst for inst in function.body if not (inst.type == 'set_var' and inst.action == "=" and inst.args[0] is inst.args[1])]
+    function.temporaries = set(variables)
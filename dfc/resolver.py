@@ -0,0 +1,168 @@
+from . import nodes
+from .scanner import TokenLocation
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class VariableSymbol:
+    name: str
+    type: nodes.Type
+    scope: str # 'game', 'save', 'var', 'local' or 'line'
+    is_out: bool = False
+
+@dataclass(frozen=True, slots=True, eq=False)
+class FunctionSymbol:
+    name: str
+    args: List[tuple[str, nodes.Type, bool, bool, bool, str]] # same as FuncDefinition.args
+
+
+class Resolver:
+    """Binds every name in a tree to its symbol before any code is generated.
+
+    Definitions, variables, assignments and function calls get their symbol in
+    their `symbol` field, so the generator never has to look a name up. Names
+    are visible from their definition onwards, the same order the generator
+    walks the tree in. Functions only have one level of locals, so the tables
+    are flat: the globals and the locals of the function being resolved.
+    Undefined names don't stop the walk, they're all raised together at the
+    end as one ResolverError.
+    """
+    globals: dict[str, VariableSymbol]
+    functions: dict[str, FunctionSymbol]
+    locals: dict[str, VariableSymbol]
+    errors: List["ResolverError"]
+
+    def resolve(self, tree: nodes.TopDefinitions) -> nodes.TopDefinitions:
+        self.reset()
+
+        for definition in tree.definitions:
+            self._resolve_node(definition)
+
+        self._raise_errors()
+        return tree
+
+    def reset(self):
+        self.globals = {}
+        self.functions = {}
+        self.locals = self.globals
+        self.errors = []
+
+    # top level definitions can also be resolved one at a time, in source order
+    def resolve_definition(self, definition):
+        self._resolve_node(definition)
+        self._raise_errors()
+
+    def lookup(self, name: str) -> VariableSymbol:
+        symbol = self.locals.get(name)
+        if symbol is None:
+            symbol = self.globals.get(name)
+
+        return symbol
+
+    # Expressions can nest deeper than Python's recursion limit, so they're
+    # walked with a stack. A _resolve_<Node> method binds the node's own
+    # names and returns the nodes under it, resolved after it in order.
+    def _resolve_node(self, node):
+        stack = [node]
+
+        while stack:
+            node = stack.pop()
+            method = getattr(self, f"_resolve_{type(node).__name__}", None)
+
+            # literals don't reference any names
+            if method:
+                stack.extend(reversed(method(node)))
+
+    def _error(self, msg: str, location: TokenLocation):
+        self.errors.append(ResolverError(msg, location))
+
+    def _raise_errors(self):
+        if self.errors:
+            (errors, self.errors) = (self.errors, [])
+            raise ResolverError(errors[0].msg, errors[0].location, errors)
+
+    def _resolve_FuncDefinition(self, node: nodes.FuncDefinition):
+        # symbols don't keep the body alive, only the signature
+        node.symbol = self.functions[node.name] = FunctionSymbol(name=node.name, args=node.args)
+
+        # external definition
+        if node.body == None: return ()
+
+        self.locals = {}
+
+        for arg in node.args:
+            # plural arguments are lists
+            arg_type = nodes.Type.get('list', (arg[1],)) if arg[3] else arg[1]
+            self.locals[arg[0]] = VariableSymbol(name=arg[0], type=arg_type, scope="line", is_out=arg[4])
+
+        for stmt in node.body:
+            self._resolve_node(stmt)
+
+        self.locals = self.globals
+        return ()
+
+    def _resolve_VarDefintion(self, node: nodes.VarDefintion):
+        node.symbol = self.locals[node.name] = VariableSymbol(name=node.name, type=node.type, scope=node.scope)
+
+        return (node.value,) if node.value else ()
+
+    def _resolve_AssignVar(self, node: nodes.AssignVar):
+        node.symbol = self.lookup(node.name)
+
+        if node.symbol is None:
+            self._error(f"Assigning an undefined variable '{node.name}'", node.location)
+
+        return (node.value,)
+
+    def _resolve_Variable(self, node: nodes.Variable):
+        node.symbol = self.lookup(node.name)
+
+        if node.symbol is None:
+            self._error(f"Undefined variable '{node.name}'", node.location)
+
+        return ()
+
+    def _resolve_CallFunction(self, node: nodes.CallFunction):
+        node.symbol = self.functions.get(node.name)
+
+        if node.symbol is None:
+            self._error(f"Undefined function '{node.name}'", node.location)
+
+        return node.args
+
+    def _resolve_CallCB(self, node: nodes.CallCB):
+        return node.args
+
+    def _resolve_BinaryOperation(self, node: nodes.BinaryOperation):
+        return (node.left, node.right)
+
+    def _resolve_Cast(self, node: nodes.Cast):
+        return (node.value,)
+
+    def _resolve_Index(self, node: nodes.Index):
+        return (node.obj, node.index)
+
+    def _resolve_SetIndex(self, node: nodes.SetIndex):
+        return (node.obj, node.index, node.value)
+
+    def _resolve_Dictionary(self, node: nodes.Dictionary):
+        return [value for (key, value) in node.data]
+
+    def _resolve_ListValue(self, node: nodes.ListValue):
+        return node.data
+
+
+class ResolverError(Exception):
+    """The first undefined name found, `errors` holds every one of them in
+    source order and they're all part of the message."""
+    def __init__(self, msg, location: TokenLocation, errors: List["ResolverError"] = None) -> None:
+        self.msg = msg
+        self.location = location
+        self.errors = [self] if errors is None else errors
+
+    def __repr__(self) -> str:
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
+
+    def __str__(self) -> str:
+        return "\n".join(repr(error) for error in self.errors)
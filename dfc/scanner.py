@@ -1,4 +1,6 @@
 import re
+from array import array
+from bisect import bisect_right
 from enum import IntEnum, auto
 from dataclasses import dataclass
 from typing import Iterator, Tuple
@@ -78,13 +80,68 @@ class TokenType(IntEnum):
 
     EOF = auto()
 
-TokenLocation = Tuple[str, int, int]
+class SourceFile:
+    """Source text with a line-start index, built the first time a row and
+    column are actually needed (usually only for an error message)."""
+    __slots__ = ("name", "text", "_line_starts")
+
+    def __init__(self, name: str, text: str) -> None:
+        self.name = name
+        self.text = text
+        self._line_starts = None
+
+    # never changes, so copied tokens can keep pointing at the same source
+    def __deepcopy__(self, memo) -> "SourceFile":
+        return self
+
+    def location(self, offset: int) -> Tuple[str, int, int]:
+        if self._line_starts is None:
+            self._line_starts = starts = [0]
+            idx = self.text.find("\n")
+            while idx != -1:
+                starts.append(idx + 1)
+                idx = self.text.find("\n", idx + 1)
+
+        row = bisect_right(self._line_starts, offset)
+        return (self.name, row, offset - self._line_starts[row - 1] + 1)
+
+
+class TokenLocation:
+    """(file, row, col) of an offset in a source, resolved on demand."""
+    __slots__ = ("source", "offset")
+
+    def __init__(self, source: SourceFile, offset: int) -> None:
+        self.source = source
+        self.offset = offset
+
+    @property
+    def file(self) -> str:
+        return self.source.name
+
+    @property
+    def row(self) -> int:
+        return self.source.location(self.offset)[1]
+
+    @property
+    def col(self) -> int:
+        return self.source.location(self.offset)[2]
+
+    def __iter__(self):
+        return iter(self.source.location(self.offset))
+
+    def __repr__(self) -> str:
+        return repr(self.source.location(self.offset))
 
 @dataclass
 class Token:
     type: TokenType
     value: any
-    location: TokenLocation
+    offset: int
+    source: SourceFile
+
+    @property
+    def location(self) -> TokenLocation:
+        return TokenLocation(self.source, self.offset)
 
 
 class ScannerError(Exception):
@@ -93,18 +150,17 @@ class ScannerError(Exception):
         self.location = location
 
     def __repr__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
 
     def __str__(self) -> str:
-        return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
+        return "%s:%d:%d: [ERROR]: %s" % (tuple(self.location) + (self.msg,))
 
 
 class Scanner:
-    ws_skip = re.compile(r'[^\t\r ]')
+    # whitespace, newlines and comments, rows are worked out from offsets when needed
+    ws_skip = re.compile(r'(?:[\t\r\n ]+|\/\/.*)*')
 
     token_definitions = {
-        'NEWLINE':                     r'\n',
-        'IGNORE':                      r'\/\/.*',
         TokenType.NUMBER:              r'\d+', # TODO: Add float
 
         TokenType.STAR:                r'\*',
@@ -123,8 +179,8 @@ class Scanner:
         TokenType.DOT:                 r'\.',
         TokenType.SEMICOLON:           r';',
         TokenType.COLON:               r':',
-        TokenType.OR:                  r'\|\||\bor\b',
-        TokenType.AND:                 r'&&|\band\b',
+        TokenType.OR:                  r'\|\|',
+        TokenType.AND:                 r'&&',
         TokenType.ARROW_UP:            r'\^',
         TokenType.PIPE:                r'\|',
         TokenType.AMPERSAND:           r'&',
@@ -138,102 +194,169 @@ class Scanner:
         TokenType.LEQUALS:             r'<=',
         TokenType.LOWER:               r'<',
 
-        TokenType.TYPE:                r'\bnum\b|\bstr\b|\bdict\b|\blist\b|\bgval\b|\bvec\b|\bpot\b|\btxt\b|\bpar\b|\bany\b|\bitem\b|\bblock\b',
-        TokenType.PROC:                r'\bproc\b',
-        TokenType.FUNC:                r'\bfunc\b',
-        TokenType.CODEBLOCK:           r'\bcodeblock\b',
-        # TokenType.STRUCT:              r'\bstruct\b',
-        TokenType.OUT:                 r'\bout\b',
-        # TokenType.CLASS:               r'\bclass\b',
-        # TokenType.ENUM:                r'\benum\b',
-
-        TokenType.CONST:               r'\bconst\b',
-        TokenType.LOCAL:               r'\blocal\b',
-        TokenType.GAME:                r'\bgame\b',
-        TokenType.SAVE:                r'\bsave\b',
-        TokenType.VAR:                 r'\bvar\b',
-        TokenType.BREAK:               r'\bbreak\b',
-        # TokenType.EXTERNAL:            r'\bexternal\b',
-        TokenType.RETURN:              r'\breturn\b',
-        # TokenType.NEW:                 r'\bnew\b',
-        TokenType.TRUE:                r'\btrue\b',
-        TokenType.FALSE:               r'\bfalse\b',
-        TokenType.WHILE:               r'\bwhile\b',
-        TokenType.IF:                  r'\bif\b',
-        TokenType.ELSE:                r'\belse\b',
-        # TokenType.HERE:                r'\bhere\b',
-        
         # TokenType.DEFINE:              r'%define\b',
         # TokenType.INCLUDE:             r'%include\b',
-        TokenType.TARGET:              r'@all\b|@allmobs\b|@default\b|@damager\b|@victim\b|@selection\b|@killer\b|@shooter\b',
+        TokenType.TARGET:              r'@[a-zA-Z_][a-zA-Z0-9_]*', # checked against `targets`
         TokenType.PRECENT:             r'%',
 
-        TokenType.STRING:              r'[ubf]?r?("(?!"").*?(?<!\\)(\\\\)*?")',
-        TokenType.STRING_VAR:              r'\$[ubf]?r?("(?!"").*?(?<!\\)(\\\\)*?")',
-        TokenType.STYLED_TEXT:         r'[ubf]?r?(`(?!``).*?(?<!\\)(\\\\)*?`)',
-        TokenType.IDENTIFIER:          r'[a-zA-Z_][a-zA-Z0-9_]*'
+        TokenType.STRING:              r'[ubf]?r?(?:"(?!"").*?(?<!\\)(?:\\\\)*?")',
+        TokenType.STRING_VAR:          r'\$[ubf]?r?(?:"(?!"").*?(?<!\\)(?:\\\\)*?")',
+        TokenType.STYLED_TEXT:         r'[ubf]?r?(?:`(?!``).*?(?<!\\)(?:\\\\)*?`)',
+        TokenType.IDENTIFIER:          r'[a-zA-Z_][a-zA-Z0-9_]*' # keywords are picked out through `keywords`
         # TokenType.CHAR:                 r"'\\0'|'\\n'|'\\r'|'\\''|'\\t'|'\\\\'|'[ -&(-~]'",
     }
 
+    # identifiers that are actually keywords
+    keywords = {
+        'num': TokenType.TYPE,
+        'str': TokenType.TYPE,
+        'dict': TokenType.TYPE,
+        'list': TokenType.TYPE,
+        'gval': TokenType.TYPE,
+        'vec': TokenType.TYPE,
+        'pot': TokenType.TYPE,
+        'txt': TokenType.TYPE,
+        'par': TokenType.TYPE,
+        'any': TokenType.TYPE,
+        'item': TokenType.TYPE,
+        'block': TokenType.TYPE,
+
+        'proc': TokenType.PROC,
+        'func': TokenType.FUNC,
+        'codeblock': TokenType.CODEBLOCK,
+        # 'struct': TokenType.STRUCT,
+        'out': TokenType.OUT,
+        # 'class': TokenType.CLASS,
+        # 'enum': TokenType.ENUM,
+
+        'const': TokenType.CONST,
+        'local': TokenType.LOCAL,
+        'game': TokenType.GAME,
+        'save': TokenType.SAVE,
+        'var': TokenType.VAR,
+        'break': TokenType.BREAK,
+        # 'external': TokenType.EXTERNAL,
+        'return': TokenType.RETURN,
+        # 'new': TokenType.NEW,
+        'true': TokenType.TRUE,
+        'false': TokenType.FALSE,
+        'while': TokenType.WHILE,
+        'if': TokenType.IF,
+        'else': TokenType.ELSE,
+        # 'here': TokenType.HERE,
+
+        'or': TokenType.OR,
+        'and': TokenType.AND,
+    }
+
+    targets = frozenset(('@all', '@allmobs', '@default', '@damager', '@victim', '@selection', '@killer', '@shooter'))
+
     master_regex = re.compile('|'.join(
         f"(?P<G{name}>{pattern})" for name, pattern in token_definitions.items()
     ))
 
+    # token type of every group in master_regex, keyed by match.lastindex
+    token_kinds = {index: TokenType(int(name[1:])) for name, index in master_regex.groupindex.items()}
+
     def input(self, code: str, file: str) -> None:
         self.buffer = code
         self.pos = 0
-        self.col = 1
-        self.row = 1
         self.file = file
+        self.source = SourceFile(file, code)
 
     def next_token(self) -> Token:
-        # if position is at end, no more tokens
-        if self.pos >= len(self.buffer):
+        scanned = self._scan()
+        if scanned is None:
             return None
 
-        # Find first non whitespace character
-        m = self.ws_skip.search(self.buffer, self.pos)
+        (token_type, start, end) = scanned
+        return Token(type=token_type, value=self.buffer[start:end], offset=start, source=self.source)
+
+    def _scan(self) -> Tuple[TokenType, int, int]:
+        # skip to the first character of the next token
+        start = self.ws_skip.match(self.buffer, self.pos).end()
 
-        if m:
-            old_pos = self.pos
-            self.pos = m.start()
-            self.col += self.pos - old_pos
-        else:
-            # this means we didn't find a character meaning we're at the end
+        # if position is at end, no more tokens
+        if start >= len(self.buffer):
+            self.pos = start
             return None
 
         # match against main regex
-        m = self.master_regex.match(self.buffer, self.pos)
-
-        if m:
-            token_type = m.lastgroup
-
-            if token_type == 'GIGNORE':
-                self.pos = m.end()
-                return self.next_token()
+        m = self.master_regex.match(self.buffer, start)
 
-            elif token_type == 'GNEWLINE':
-                self.row += 1
-                self.col = 1
-                self.pos = m.end()
-                return self.next_token()
+        if not m:
+            raise ScannerError(f"Unexpected character '{self.buffer[start]}'", TokenLocation(self.source, start))
 
-            string_repr = m.string[m.start():m.end()]
-            token = Token(type= TokenType(int(token_type[1:])), value=string_repr, location=(self.file, self.row, self.col))
+        token_type = self.token_kinds[m.lastindex]
 
-            old_pos = self.pos
-            self.pos = m.end()
+        if token_type is TokenType.IDENTIFIER:
+            token_type = self.keywords.get(m.group(), TokenType.IDENTIFIER)
 
-            self.col += self.pos - old_pos
-            return token
+        elif token_type is TokenType.TARGET and m.group() not in self.targets:
+            raise ScannerError(f"Unexpected character '@'", TokenLocation(self.source, start))
 
-        raise ScannerError(f"Unexpected character '{self.buffer[self.pos]}'", (self.file, self.row, self.col))
+        self.pos = m.end()
+        return (token_type, start, self.pos)
 
     def tokens(self) -> Iterator[Token]:
         # custom iterator
         while True:
             tok = self.next_token()
             if tok is None:
-                yield Token(type=TokenType.EOF, value=None, location=(self.file, self.row, self.col))
+                yield Token(type=TokenType.EOF, value=None, offset=self.pos, source=self.source)
                 break
-            yield tok
\ No newline at end of file
+            yield tok
+
+    def token_buffer(self) -> "TokenBuffer":
+        # scans everything left into a TokenBuffer, without creating any Token objects
+        buffer = TokenBuffer(self.source)
+        kinds = buffer.kinds.append
+        starts = buffer.starts.append
+        ends = buffer.ends.append
+
+        while True:
+            scanned = self._scan()
+            if scanned is None:
+                kinds(TokenType.EOF)
+                starts(self.pos)
+                ends(self.pos)
+                return buffer
+
+            kinds(scanned[0])
+            starts(scanned[1])
+            ends(scanned[2])
+
+
+class TokenBuffer:
+    """Columnar token storage: kind, start and end offset of every token in
+    parallel arrays. Token text is sliced from the source only when asked for
+    and Token objects are only created by indexing."""
+    __slots__ = ("source", "kinds", "starts", "ends")
+
+    def __init__(self, source: SourceFile) -> None:
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, idx: int) -> Token:
+        return Token(type=_token_types[self.kinds[idx]], value=self.value(idx), offset=self.starts[idx], source=self.source)
+
+    def type(self, idx: int) -> TokenType:
+        return _token_types[self.kinds[idx]]
+
+    def value(self, idx: int) -> str:
+        if self.kinds[idx] == TokenType.EOF:
+            return None
+
+        return self.source.text[self.starts[idx]:self.ends[idx]]
+
+    def location(self, idx: int) -> TokenLocation:
+        return TokenLocation(self.source, self.starts[idx])
+
+
+# TokenType by value, for turning the raw kinds of a TokenBuffer back into members
+_token_types = {token_type.value: token_type for token_type in TokenType}
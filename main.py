@@ -1,22 +1,12 @@
 import dfc
 
-scanner = dfc.Scanner()
-parser = dfc.Parser()
 generator = dfc.Generator()
+generator.cache_dir = "__dfccache__/functions"
 
-f = open("test.dfc", "r")
-code = f.read()
-f.close()
+# scans and parses test.dfc, unless __dfccache__/trees already has its tree
+tree = dfc.parse_file("test.dfc")
 
-f = open("actiondump.json", "rb")
-actiondump = f.read()
-f.close()
-
-scanner.input(code, "test.dfc")
-tokens = list(scanner.tokens())
-tree = parser.parse(tokens, "test.dfc")
-
-generator.set_action_data(actiondump)
+generator.load_action_data("actiondump.json")
 lines = generator.generate(tree)
 
 #print(lines)
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import dfc
+from dfc import actiondump
+
+DUMP = {
+    "sounds": [{"sound": "Pling", "icon": {"material": "NOTE_BLOCK"}}],
+    "codeblocks": [{"name": "PLAYER ACTION", "identifier": "player_action", "item": {"material": "COBBLESTONE"}}],
+    "actions": [{"name": "SendMessage", "codeblockName": "PLAYER ACTION", "tags": [], "description": "Sends a message 😀", "icon": {"arguments": []}}],
+    "shops": [1, 2, 3],
+}
+EXPECTED = {
+    "codeblocks": [{"name": "PLAYER ACTION", "identifier": "player_action"}],
+    "actions": [{"name": "SendMessage", "codeblockName": "PLAYER ACTION", "tags": [], "icon": {"arguments": []}}],
+}
+
+
+def test_text_bytes_and_paths_read_the_same(tmp_path):
+    text = json.dumps(DUMP, ensure_ascii=False)
+    path = tmp_path / "dump.json"
+    path.write_bytes(text.encode("utf-8"))
+
+    assert actiondump.read_action_dump(text) == EXPECTED
+    assert actiondump.read_action_dump(text.encode("utf-8")) == EXPECTED
+    assert actiondump.read_action_dump(path) == EXPECTED
+
+def test_str_is_never_a_path(tmp_path):
+    path = tmp_path / "dump.json"
+    path.write_text(json.dumps(DUMP))
+
+    with pytest.raises(ValueError):
+        actiondump.read_action_dump(str(path))
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_values_split_across_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(actiondump, "_CHUNK_SIZE", chunk_size)
+    dump = dict(DUMP, codeblocks=DUMP["codeblocks"] + [{"name": "X", "identifier": "x", "slot": -15000000000.25}])
+
+    assert actiondump.read_action_dump(json.dumps(dump, ensure_ascii=False, indent=1))["codeblocks"][-1] == {"name": "X", "identifier": "x", "slot": -15000000000.25}
+
+def test_generator_takes_text_or_bytes():
+    text = json.dumps(DUMP, ensure_ascii=False)
+    (from_text, from_bytes) = (dfc.Generator(), dfc.Generator())
+    from_text.set_action_data(text)
+    from_bytes.set_action_data(text.encode("utf-8"))
+
+    assert from_text.registry.digest == from_bytes.registry.digest
+    assert from_text.registry.action("player_action", "SendMessage") == from_bytes.registry.action("player_action", "SendMessage")
@@ -0,0 +1,60 @@
+import builtins, hashlib, os, pickle
+
+import pytest
+
+from dfc import astcache, nodes
+
+
+def opcode_string(value: str) -> bytes:
+    data = value.encode()
+    return b"\x8c" + bytes([len(data)]) + data # SHORT_BINUNICODE
+
+def evil_pickle() -> bytes:
+    """dfc.scanner's `re.enum.bltns.exec`, called on code setting a flag."""
+    return (
+        b"\x80\x04"
+        + opcode_string("dfc.scanner") + opcode_string("re.enum.bltns.exec") + b"\x93" # STACK_GLOBAL
+        + opcode_string("import builtins; builtins.dfc_cache_exploited = True") + b"\x85" # TUPLE1
+        + b"R." # REDUCE, STOP
+    )
+
+def source(tmp_path) -> tuple[str, str]:
+    path = tmp_path / "x.dfc"
+    path.write_text("func f() {\n  var x: num = 1;\n}\n")
+    cache_path = tmp_path / "__dfccache__" / "trees" / "x.dfcc"
+    cache_path.parent.mkdir(parents=True)
+    return (str(path), str(cache_path))
+
+
+@pytest.mark.parametrize("in_header", [False, True])
+def test_planted_cache_cannot_run_code(tmp_path, in_header):
+    (path, cache_path) = source(tmp_path)
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    with open(cache_path, "wb") as f:
+        if not in_header:
+            pickle.dump((astcache.compiler_version(), digest), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        f.write(evil_pickle())
+
+    try:
+        tree = astcache.parse_file(path)
+        assert not hasattr(builtins, "dfc_cache_exploited")
+    finally:
+        if hasattr(builtins, "dfc_cache_exploited"):
+            del builtins.dfc_cache_exploited
+
+    # the cache is ignored and the source parsed again
+    assert isinstance(tree, nodes.TopDefinitions)
+    assert [definition.name for definition in tree.definitions] == ["f"]
+
+def test_cached_tree_is_loaded(tmp_path, monkeypatch):
+    (path, cache_path) = source(tmp_path)
+    astcache.parse_file(path)
+    assert os.path.exists(cache_path)
+
+    monkeypatch.setattr(astcache.Parser, "parse", None)
+    tree = astcache.parse_file(path)
+    assert [definition.name for definition in tree.definitions] == ["f"]
+    assert tree.definitions[0].body[0].type is nodes.Type.get("num")
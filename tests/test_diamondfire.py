@@ -0,0 +1,21 @@
+from dfc import diamondfire as df
+from dfc.actiondump import ActionRecord, ActionRegistry, CodeblockRecord, TagRecord
+
+
+def registry() -> ActionRegistry:
+    tag = TagRecord(name="Mode", options=("A", "B"), default_option="A", slot=26)
+    action = ActionRecord(name="Act", codeblock="player_action", tags=(tag,), arguments=())
+    return ActionRegistry((CodeblockRecord(name="PLAYER ACTION", identifier="player_action"),), (action,))
+
+
+def test_default_tags_are_new_dicts():
+    reg = registry()
+    schema = df.tag_schema(reg, reg.action("player_action", "Act"))
+
+    first = schema.generate(schema.defaults)
+    first[0]["item"]["data"]["option"] = "B"
+    first.append({})
+
+    second = schema.generate(schema.defaults)
+    assert second == [{"item": {"id": "bl_tag", "data": {"block": "player_action", "action": "Act", "option": "A", "tag": "Mode"}}, "slot": 26}]
+    assert schema.encode(schema.defaults) == '{"item": {"id": "bl_tag", "data": {"block": "player_action", "action": "Act", "option": "A", "tag": "Mode"}}, "slot": 26}'
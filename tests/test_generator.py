@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import dfc
+from dfc import diamondfire as df
+from dfc.actiondump import ActionRegistry, build_action_registry, read_action_dump
+
+
+@pytest.fixture(scope="module")
+def registry() -> ActionRegistry:
+    with open(os.path.join(os.path.dirname(__file__), "..", "actiondump.json"), "rb") as f:
+        return build_action_registry(read_action_dump(f.read()))
+
+def generate(registry: ActionRegistry, source: str) -> df.Codeline:
+    generator = dfc.Generator()
+    generator.set_registry(registry)
+    generator.optimization_level = 0
+
+    scanner = dfc.Scanner()
+    scanner.input(source, "t.dfc")
+    return generator.generate(dfc.Parser().parse(scanner.tokens(), "t.dfc"))[-1]
+
+
+def test_right_nested_arithmetic_of_any_depth(registry):
+    depth = 3000
+    line = generate(registry, "func f(a: num) {\n  var x: num = " + "(a + " * depth + "1" + ")" * depth + ";\n}")
+
+    # innermost first, each result is read by the block after it
+    sums = line.blocks[1:]
+    assert len(sums) == depth
+    assert sums[0].args[1:] == [df.VariableItem.get("a", "line"), df.NumberItem.get(1.0)]
+    assert all(block.args[2] is previous.args[0] for (previous, block) in zip(sums, sums[1:]))
+    assert sums[-1].args[0] == df.VariableItem.get("x", "line")
+
+def test_nested_indexes_and_casts(registry):
+    depth = 1000
+    line = generate(registry, "func f(l: list<num>, a: num) {\n  var x: num = " + "((num)l[" * depth + "1" + "] * a)" * depth + ";\n}")
+
+    # the outermost cast doesn't pass its destination on, its result is copied
+    actions = [block.action for block in line.blocks[1:]]
+    assert actions == ["GetListValue", "x"] * depth + ["="]
@@ -0,0 +1,34 @@
+import dfc
+from dfc import nodes
+
+
+def parse(source: str) -> nodes.TopDefinitions:
+    scanner = dfc.Scanner()
+    scanner.input(source, "t.dfc")
+    return dfc.Parser().parse(scanner.tokens(), "t.dfc")
+
+def spine(node, side: str) -> list:
+    """The nodes down one side of nested binary operations."""
+    chain = [node]
+    while isinstance(chain[-1], nodes.BinaryOperation):
+        chain.append(getattr(chain[-1], side))
+
+    return chain
+
+
+def test_deep_constants_are_copied_per_use():
+    source = (
+        "const long = " + " + ".join(["x"] * 3000) + ";\n"
+        + "const nested = " + "(" * 2000 + "x" + " * 2)" * 2000 + ";\n"
+        + "func f() {\n  var x: num = 1;\n  var a: num = long;\n  var b: num = long + nested;\n}\n"
+    )
+    body = parse(source).definitions[0].body
+
+    first = spine(body[1].value, "left")
+    second = spine(body[2].value.left, "left")
+    assert len(first) == len(second) == 3000
+    assert all(a is not b for (a, b) in zip(first, second))
+    # names are resolved where the constant is used, so each use has its own
+    assert first[-1].name == second[-1].name == "x" and first[-1] is not second[-1]
+
+    assert len(spine(body[2].value.right, "left")) == 2001
@@ -0,0 +1,312 @@
+import os, random
+import pytest
+
+import dfc
+from dfc import ir, passes
+from dfc import diamondfire as df
+from dfc.actiondump import ActionRegistry, build_action_registry, read_action_dump
+
+
+def var(name: str) -> df.VariableItem:
+    return df.VariableItem.get(name, 'line')
+
+def num(value: float) -> df.NumberItem:
+    return df.NumberItem.get(float(value))
+
+def set_var(action: str, *args: df.Item) -> ir.Instruction:
+    return ir.Instruction(type='set_var', action=action, args=list(args))
+
+def function(*body: ir.Instruction, temporaries=()) -> ir.Function:
+    return ir.Function(name="f", params=[], body=list(body), temporaries=set(temporaries))
+
+def blocks(function: ir.Function) -> list[tuple]:
+    return [(inst.type, inst.action, *inst.args) for inst in function.body]
+
+
+def test_single_operand_exponent_is_kept():
+    # DF squares a lone operand of ^, it's not a copy
+    f = function(set_var("Exponent", var("r"), var("a")))
+    passes.simplify_arithmetic(f)
+    assert blocks(f) == [('set_var', "Exponent", var("r"), var("a"))]
+
+def test_single_operand_minus_and_divide_are_kept():
+    f = function(set_var("-", var("r"), var("a")), set_var("/", var("s"), var("a")))
+    passes.simplify_arithmetic(f)
+    assert blocks(f) == [('set_var', "-", var("r"), var("a")), ('set_var', "/", var("s"), var("a"))]
+
+def test_single_operand_sum_and_product_are_copies():
+    f = function(set_var("+", var("r"), var("a")), set_var("x", var("s"), var("a")))
+    passes.simplify_arithmetic(f)
+    assert blocks(f) == [('set_var', "=", var("r"), var("a")), ('set_var', "=", var("s"), var("a"))]
+
+def call(*args: df.Item) -> ir.Instruction:
+    return ir.Instruction(type='call_func', action='dynamic', args=list(args), data="g")
+
+def temps(count: int) -> list[df.VariableItem]:
+    return [var(f"__tmp{i}") for i in range(count)]
+
+
+# constant folding and copy propagation
+
+def test_constants_are_folded():
+    f = function(set_var("+", var("r"), num(2), num(3)), set_var("x", var("s"), num(2), num(3), num(4)))
+    passes.fold_constants(f)
+    assert blocks(f) == [('set_var', "=", var("r"), num(5)), ('set_var', "=", var("s"), num(24))]
+
+def test_inexact_results_are_left_to_df():
+    f = function(set_var("/", var("r"), num(1), num(3)), set_var("/", var("s"), num(1), num(0)))
+    passes.fold_constants(f)
+    assert blocks(f) == [('set_var', "/", var("r"), num(1), num(3)), ('set_var', "/", var("s"), num(1), num(0))]
+
+def test_known_constants_are_propagated():
+    f = function(set_var("=", var("x"), num(5)), set_var("+", var("r"), var("x"), num(1)))
+    passes.fold_constants(f)
+    assert blocks(f)[1] == ('set_var', "=", var("r"), num(6))
+
+def test_calls_forget_known_values():
+    f = function(set_var("=", var("x"), num(5)), call(), set_var("+", var("r"), var("x"), num(1)))
+    passes.fold_constants(f)
+    assert blocks(f)[2] == ('set_var', "+", var("r"), var("x"), num(1))
+
+
+# algebraic simplification, per action
+
+def simplified(*args: df.Item, action: str) -> tuple:
+    f = function(set_var(action, var("r"), *args))
+    passes.simplify_arithmetic(f)
+    return blocks(f)[0][1:]
+
+def test_sum_identities_and_constants():
+    assert simplified(var("a"), num(0), action="+") == ("=", var("r"), var("a"))
+    assert simplified(num(1), var("a"), num(2), action="+") == ("+", var("r"), var("a"), num(3))
+    assert simplified(num(0), num(0), action="+") == ("=", var("r"), num(0))
+
+def test_product_identities_and_constants():
+    assert simplified(var("a"), num(1), action="x") == ("=", var("r"), var("a"))
+    assert simplified(num(2), var("a"), num(3), action="x") == ("x", var("r"), var("a"), num(6))
+    # x * 0.5 * 4 isn't x * 2 once DF rounds x * 0.5
+    assert simplified(var("a"), num(0.5), num(4), action="x") == ("x", var("r"), var("a"), num(0.5), num(4))
+
+def test_difference_identities_and_constants():
+    assert simplified(var("a"), num(0), action="-") == ("=", var("r"), var("a"))
+    assert simplified(var("a"), num(1), var("b"), num(2), action="-") == ("-", var("r"), var("a"), var("b"), num(3))
+    # the first operand isn't subtracted
+    assert simplified(num(0), var("a"), action="-") == ("-", var("r"), num(0), var("a"))
+
+def test_quotient_identities():
+    assert simplified(var("a"), num(1), action="/") == ("=", var("r"), var("a"))
+    assert simplified(var("a"), num(2), num(1), action="/") == ("/", var("r"), var("a"), num(2))
+    assert simplified(num(1), var("a"), action="/") == ("/", var("r"), num(1), var("a"))
+
+def test_exponent_identities():
+    assert simplified(var("a"), num(0), action="Exponent") == ("=", var("r"), num(1))
+    assert simplified(var("a"), num(1), action="Exponent") == ("=", var("r"), var("a"))
+    assert simplified(var("a"), num(2), action="Exponent") == ("x", var("r"), var("a"), var("a"))
+    assert simplified(var("a"), num(3), action="Exponent") == ("Exponent", var("r"), var("a"), num(3))
+
+
+# flattening chains into one block
+
+def chain(action: str, inner: int, outer: int) -> ir.Function:
+    """r = (v0 .. v{inner-1}) action v{inner} .. with `inner` + `outer` operands in total."""
+    (t,) = temps(1)
+    operands = [var(f"v{i}") for i in range(inner + outer)]
+    return function(
+        set_var(action, t, *operands[:inner]),
+        set_var(action, var("r"), t, *operands[inner:]),
+        temporaries=[t]
+    )
+
+def test_chain_filling_the_chest_is_flattened():
+    f = chain("+", 13, 13)
+    passes.simplify_arithmetic(f)
+    passes.remove_dead_stores(f)
+    assert blocks(f) == [('set_var', "+", var("r"), *[var(f"v{i}") for i in range(26)])]
+
+def test_chain_overflowing_the_chest_is_kept():
+    f = chain("+", 13, 14)
+    passes.simplify_arithmetic(f)
+    passes.remove_dead_stores(f)
+    assert [len(inst.args) for inst in f.body] == [14, 16]
+
+def test_only_the_first_operand_of_a_difference_is_flattened():
+    (t0, t1) = temps(2)
+    f = function(
+        set_var("-", t0, var("a"), num(1)),
+        set_var("-", t1, var("b"), num(2)),
+        set_var("-", var("r"), t0, t1),
+        temporaries=[t0, t1]
+    )
+    passes.simplify_arithmetic(f)
+    passes.remove_dead_stores(f)
+    assert blocks(f) == [('set_var', "-", t1, var("b"), num(2)), ('set_var', "-", var("r"), var("a"), t1, num(1))]
+
+
+# dead stores
+
+def test_overwritten_store_is_removed():
+    f = function(set_var("=", var("x"), num(1)), set_var("=", var("x"), num(2)))
+    passes.remove_dead_stores(f)
+    assert blocks(f) == [('set_var', "=", var("x"), num(2))]
+
+def test_store_read_by_a_call_is_kept():
+    f = function(set_var("=", var("x"), num(1)), call(), set_var("=", var("x"), num(2)))
+    passes.remove_dead_stores(f)
+    assert len(f.body) == 3
+
+def test_own_variables_outlive_the_function():
+    # the caller, or code called later, can read them
+    f = function(set_var("=", var("x"), num(1)))
+    passes.remove_dead_stores(f)
+    assert len(f.body) == 1
+
+def test_unread_temporary_is_removed():
+    (t,) = temps(1)
+    f = function(set_var("+", t, var("a"), num(1)), call(), temporaries=[t])
+    passes.remove_dead_stores(f)
+    assert blocks(f) == [('call_func', 'dynamic')]
+
+
+# temporary allocation
+
+def test_temporaries_are_reused():
+    (t0, t1, t2, t3) = temps(4)
+    f = function(
+        set_var("+", t0, var("a"), num(1)),
+        set_var("x", t1, t0, num(2)),
+        set_var("+", t2, var("b"), num(1)),
+        set_var("x", t3, t2, num(2)),
+        set_var("+", var("r"), t1, t3),
+        temporaries=[t0, t1, t2, t3]
+    )
+    passes.allocate_temporaries(f)
+    assert blocks(f) == [
+        ('set_var', "+", t0, var("a"), num(1)),
+        ('set_var', "x", t0, t0, num(2)),
+        ('set_var', "+", t1, var("b"), num(1)),
+        ('set_var', "x", t1, t1, num(2)),
+        ('set_var', "+", var("r"), t0, t1),
+    ]
+    assert f.temporaries == {t0, t1}
+
+
+# levels 0 and 1 compute the same values
+
+def run(line: df.Codeline, params: dict[str, float]) -> list[dict[str, float]]:
+    """Runs a function of arithmetic and calls, rounding every result to 3
+    decimals like DF. Returns the line variables every call, and the caller
+    at the end, get to see. Calls set the variables given to them."""
+    values = dict(params)
+    seen = []
+
+    def visible() -> dict[str, float]:
+        return {name: value for (name, value) in values.items() if not name.startswith("__tmp")}
+
+    def value(item: df.Item) -> float:
+        return values[item.name] if type(item) is df.VariableItem else float(item.value)
+
+    for block in line.blocks[1:]:
+        if block.type == 'call_func':
+            seen.append(visible())
+            for arg in block.args:
+                values[arg.name] = 1000.0 + len(seen)
+
+            continue
+
+        assert block.type == 'set_var'
+        operands = [value(arg) for arg in block.args[1:]]
+        result = operands[0]
+        for operand in operands[1:]:
+            result = passes._ARITHMETIC[block.action](result, operand)
+
+        values[block.args[0].name] = round(result, 3)
+
+    seen.append(visible())
+    return seen
+
+def random_program(rng: random.Random) -> str:
+    names = ["a", "b"]
+
+    def expr(depth: int) -> str:
+        if depth == 0 or rng.random() < 0.3:
+            return rng.choice(names) if rng.random() < 0.6 else str(rng.randint(0, 4))
+
+        op = rng.choice("+-*/^")
+        if op == "/":
+            return f"({expr(depth - 1)} / {rng.choice((1, 2, 4, 5))})"
+        if op == "^":
+            return f"({expr(depth - 1)} ^ {rng.randint(0, 3)})"
+
+        return f"({expr(depth - 1)} {op} {expr(depth - 1)})"
+
+    stmts = []
+    for _ in range(rng.randint(1, 8)):
+        kind = rng.random()
+        if kind < 0.5 or len(names) == 2:
+            stmts.append(f"var x{len(names)}: num = {expr(3)};")
+            names.append(f"x{len(names)}")
+        elif kind < 0.85:
+            stmts.append(f"{rng.choice(names[2:])} = {expr(3)};")
+        else:
+            stmts.append(f"g({rng.choice(names[2:])});")
+
+    return "func g(out r: num) {\n  r = 1;\n}\nfunc f(a: num, b: num) {\n  " + "\n  ".join(stmts) + "\n}"
+
+@pytest.fixture(scope="module")
+def registry() -> ActionRegistry:
+    with open(os.path.join(os.path.dirname(__file__), "..", "actiondump.json"), "rb") as f:
+        return build_action_registry(read_action_dump(f.read()))
+
+def compile_at(registry: ActionRegistry, source: str, level: int) -> df.Codeline:
+    generator = dfc.Generator()
+    generator.set_registry(registry)
+    generator.optimization_level = level
+
+    scanner = dfc.Scanner()
+    scanner.input(source, "t.dfc")
+    return generator.generate(dfc.Parser().parse(scanner.tokens(), "t.dfc"))[-1]
+
+def test_levels_compute_the_same_values(registry):
+    rng = random.Random(21)
+
+    for _ in range(200):
+        source = random_program(rng)
+        lines = [compile_at(registry, source, level) for level in (0, 1, 2)]
+
+        for params in ({"a": 3.0, "b": -2.5}, {"a": 0.125, "b": 7.0}):
+            expected = run(lines[0], params)
+            for line in lines[1:]:
+                assert run(line, params) == expected, source
+
+        assert len(lines[2].blocks) <= len(lines[1].blocks) <= len(lines[0].blocks)
+
+def test_long_chains_compute_the_same_values(registry):
+    terms = 3000
+    left = "func f(a: num, b: num) {\n  var x: num = " + " + ".join(["a", "b"] * (terms // 2)) + ";\n}"
+    right = "func f(a: num, b: num) {\n  var x: num = " + "(a + (b + " * (terms // 2) + "1" + "))" * (terms // 2) + ";\n}"
+
+    for source in (left, right):
+        (unoptimized, optimized) = (compile_at(registry, source, level) for level in (0, 2))
+        assert run(optimized, {"a": 1.5, "b": 2.0}) == run(unoptimized, {"a": 1.5, "b": 2.0})
+        assert len(optimized.blocks) < len(unoptimized.blocks)
+
+
+# optimization levels
+
+def pass_names(level: int) -> list[str]:
+    return [name for (name, func) in ir.PassManager(level).passes]
+
+def test_passes_per_level():
+    assert pass_names(0) == []
+    assert pass_names(1) == ["constant-folding", "dead-stores"]
+    assert pass_names(2) == ["constant-folding", "algebraic-simplification", "copy-propagation", "dead-stores", "temporary-allocation"]
+    assert pass_names(9) == pass_names(2)
+
+def test_level_runs_passes_registered_at_or_below_it(monkeypatch):
+    monkeypatch.setattr(ir, "_passes", list(ir._passes))
+    ir.register_pass("level-3", level=3)(lambda function: None)
+
+    for level in range(5):
+        assert pass_names(level) == [name for (name, min_level, func) in ir._passes if min_level <= level]
+
+    assert "level-3" not in pass_names(2) and pass_names(3)[-1] == "level-3"
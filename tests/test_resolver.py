@@ -0,0 +1,24 @@
+import pytest
+
+import dfc
+from dfc.resolver import Resolver, ResolverError
+
+
+def parse(source: str):
+    scanner = dfc.Scanner()
+    scanner.input(source, "t.dfc")
+    return dfc.Parser().parse(scanner.tokens(), "t.dfc")
+
+
+def test_every_undefined_name_is_reported():
+    tree = parse('func f() {\n  x = 1;\n  var y: num = z;\n}\nfunc g() {\n  h();\n}')
+
+    with pytest.raises(ResolverError) as info:
+        Resolver().resolve(tree)
+
+    assert [(error.msg, tuple(error.location)[1:]) for error in info.value.errors] == [
+        ("Assigning an undefined variable 'x'", (2, 3)),
+        ("Undefined variable 'z'", (3, 16)),
+        ("Undefined function 'h'", (6, 3)),
+    ]
+    assert str(info.value).splitlines() == [repr(error) for error in info.value.errors]